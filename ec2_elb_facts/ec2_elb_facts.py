@@ -27,12 +27,60 @@ options:
       - The name of a particular ELB. Pass this value to gather facts about a particular ELB, otherwise, all ELBs are returned.
     required: false
     default: null
+  filters:
+    description:
+      - A dict of filters to apply to the ELBs, as they are described. Each dict item consists of a filter key and a
+        value or list of values, any of which may match. Values may contain shell-style wildcards.
+      - The filter keys are C(name), C(vpc-id), C(scheme), C(tag-key) and C(tag:<key>). Tag filters describe the
+        tags of each page of ELBs that the other filters match.
+    required: false
+    default: null
+    version_added: "2.1"
+  page_size:
+    description:
+      - The number of ELBs to request in each page of results, from 1 to 400. ELBs are requested a page at a time
+        until there are no more.
+    required: false
+    default: 400
+    version_added: "2.1"
   region:
     description:
       - The AWS region to use. If not specified then the value of the EC2_REGION environment variable, if any, is used. See U(http://docs.aws.amazon.com/general/latest/gr/rande.html#ec2_region)
     required: false
     default: null
     aliases: [ 'aws_region', 'ec2_region' ]
+  include_health:
+    description:
+      - Whether to describe the health of the instances of each ELB. Adds the C(state) (InService, OutOfService or
+        Unknown), C(reason_code) and C(description) of each instance.
+      - The ELBs are described concurrently, see C(concurrency). An ELB whose health cannot be described has the
+        error in C(health_error) instead.
+    required: false
+    default: no
+    choices: ['yes', 'no']
+    version_added: "2.1"
+  include_tags:
+    description:
+      - Whether to return the C(tags) of each ELB, described 20 ELBs at a time.
+    required: false
+    default: no
+    choices: ['yes', 'no']
+    version_added: "2.1"
+  include_attributes:
+    description:
+      - Whether to return the C(attributes) of each ELB, its cross-zone load balancing, access log, connection
+        draining and connection settings. The ELBs are described concurrently, see C(concurrency). An ELB whose
+        attributes cannot be described has the error in C(attributes_error) instead.
+    required: false
+    default: no
+    choices: ['yes', 'no']
+    version_added: "2.1"
+  concurrency:
+    description:
+      - With C(include_health) or C(include_attributes), the maximum number of ELBs to describe at the same time.
+    required: false
+    default: 10
+    version_added: "2.1"
 
 extends_documentation_fragment: aws
 '''
@@ -48,24 +96,100 @@ EXAMPLES = '''
     filters:
       - route-table-id: rtb-00112233
 
+# Gather facts about all internal ELBs in VPC vpc-abcdef00
+- ec2_elb_facts:
+    filters:
+      vpc-id: vpc-abcdef00
+      scheme: internal
+
+# Gather facts about ELBs named web-* with a tag key env and value prod
+- ec2_elb_facts:
+    filters:
+      name: web-*
+      "tag:env": prod
+
+# Gather facts about all ELBs along with the health of their instances
+- ec2_elb_facts:
+    include_health: yes
+  register: elb_facts
+
+# Gather facts about all ELBs along with their tags and attributes
+- ec2_elb_facts:
+    include_tags: yes
+    include_attributes: yes
+
 
 '''
 
+import fnmatch
+import threading
+
+from multiprocessing.pool import ThreadPool
+
 try:
     import boto.ec2.elb
+    from boto.ec2.elb.loadbalancer import LoadBalancer
     from boto.exception import BotoServerError
     HAS_BOTO = True
 except ImportError:
     HAS_BOTO = False
 
-def get_elb_info(elb):
+# The most ELB names DescribeTags accepts in one call
+MAX_TAG_NAMES = 20
+
+# Filters matched against each ELB and against its tags
+ELB_FILTERS = ['name', 'vpc-id', 'scheme']
+TAG_FILTERS = ['tag-key']
+
+class ElbTag(object):
+    """
+    A tag in a DescribeTags response, built by boto's response parser.
+    """
+
+    def __init__(self, connection=None):
+        self.key = None
+        self.value = None
+
+    def startElement(self, name, attrs, connection):
+        return None
+
+    def endElement(self, name, value, connection):
+        if name == 'Key':
+            self.key = value
+        elif name == 'Value':
+            self.value = value
+
+class ElbTagDescription(object):
+    """
+    The tags of one ELB in a DescribeTags response, built by boto's response parser.
+    """
+
+    def __init__(self, connection=None):
+        self.load_balancer_name = None
+        self.tags = []
+
+    def startElement(self, name, attrs, connection):
+        if name == 'member':
+            tag = ElbTag(connection)
+            self.tags.append(tag)
+            return tag
+        return None
+
+    def endElement(self, name, value, connection):
+        if name == 'LoadBalancerName':
+            self.load_balancer_name = value
+
+def get_elb_info(elb, health=None):
 
 #    print elb.__dict__
     #print "*******************"
     # Add any instances to array
     instances = []
     for instance in elb.instances:
-        instances.append({ 'id': instance.id, 'state': instance.state })
+        instance_info = { 'id': instance.id, 'state': instance.state }
+        if health is not None:
+            instance_info.update(health.get(instance.id, {}))
+        instances.append(instance_info)
 
     # Health check
     health_check = { 'target': elb.health_check.target,
@@ -75,10 +199,20 @@ def get_elb_info(elb):
                      'timeout': elb.health_check.timeout
                    }
 
+    listeners = []
+    for listener in elb.listeners or []:
+        listeners.append({ 'load_balancer_port': listener.load_balancer_port,
+                           'instance_port': listener.instance_port,
+                           'protocol': listener.protocol,
+                           'instance_protocol': listener.instance_protocol,
+                           'ssl_certificate_id': listener.ssl_certificate_id,
+                           'policy_names': list(listener.policy_names or [])
+                         })
+
     elb_info = { 'subnet': elb.subnets,
                  'name': elb.name,
                  'dns_name': elb.dns_name,
-                 #'listeners': elb.listeners,
+                 'listeners': listeners,
                  'health_check': health_check,
                  'instances': instances,
                  'availability_zones': elb.availability_zones,
@@ -89,18 +223,212 @@ def get_elb_info(elb):
 
     return elb_info
 
-def list_ec2_elbs(connection, module):
+def get_instance_health(connection, name):
+
+    health = {}
+    for instance_state in connection.describe_instance_health(name):
+        health[instance_state.instance_id] = { 'state': instance_state.state,
+                                               'reason_code': instance_state.reason_code,
+                                               'description': instance_state.description
+                                             }
+
+    return health
+
+def get_elb_attributes(connection, name):
+
+    attributes = connection.get_all_lb_attributes(name)
+    access_log = attributes.access_log
+    connection_draining = attributes.connection_draining
+
+    return { 'cross_zone_load_balancing': { 'enabled': attributes.cross_zone_load_balancing.enabled },
+             'access_log': { 'enabled': access_log.enabled,
+                             's3_bucket_name': access_log.s3_bucket_name,
+                             's3_bucket_prefix': access_log.s3_bucket_prefix,
+                             'emit_interval': access_log.emit_interval
+                           },
+             'connection_draining': { 'enabled': connection_draining.enabled,
+                                      'timeout': connection_draining.timeout
+                                    },
+             'connection_settings': { 'idle_timeout': attributes.connecting_settings.idle_timeout }
+           }
+
+def get_elbs_tags(connection, names):
+    """
+    Describe the tags of the ELBs names, MAX_TAG_NAMES of them in each call to DescribeTags.
+
+    Returns:
+        A dict keyed by ELB name of a dict of its tags
+    """
+
+    elbs_tags = dict((name, {}) for name in names)
+    for i in range(0, len(names), MAX_TAG_NAMES):
+        params = {}
+        connection.build_list_params(params, names[i:i + MAX_TAG_NAMES], 'LoadBalancerNames.member.%d')
+        for description in connection.get_list('DescribeTags', params, [('member', ElbTagDescription)]):
+            elbs_tags[description.load_balancer_name] = dict((tag.key, tag.value) for tag in description.tags)
+
+    return elbs_tags
+
+def make_filter_dict(filters_dict):
+    """
+    Split filters_dict into the filters on ELBs and the filters on their tags, with a list of values for
+    each filter key.
+
+    Raises:
+        ValueError if a filter key is not supported
+    """
+
+    elb_filters = {}
+    tag_filters = {}
+
+    for k,v in filters_dict.iteritems():
+        if isinstance(v, basestring):
+            v = [ v ]
+        else:
+            v = [ str(value) for value in v ]
+
+        if k in ELB_FILTERS:
+            elb_filters[k] = v
+        elif k in TAG_FILTERS or k.startswith('tag:'):
+            tag_filters[k] = v
+        else:
+            raise ValueError("Unsupported filter %s" % k)
+
+    return elb_filters, tag_filters
+
+def match_values(value, patterns):
+
+    return value is not None and any(fnmatch.fnmatchcase(value, pattern) for pattern in patterns)
+
+def match_elb(elb, elb_filters):
+
+    values = { 'name': elb.name, 'vpc-id': elb.vpc_id, 'scheme': elb.scheme }
+    for k, patterns in elb_filters.items():
+        if not match_values(values[k], patterns):
+            return False
+
+    return True
+
+def match_tags(tags, tag_filters):
+
+    for k, patterns in tag_filters.items():
+        if k == 'tag-key':
+            if not any(match_values(key, patterns) for key in tags):
+                return False
+        elif not match_values(tags.get(k[4:]), patterns):
+            return False
+
+    return True
+
+def iter_elb_pages(connection, names, page_size):
+    """
+    Yield pages of ELBs from DescribeLoadBalancers, requesting page_size at a time and following NextMarker.
+    The next page is only requested once the previous one has been consumed.
+    """
+
+    params = {}
+    if names:
+        connection.build_list_params(params, names, 'LoadBalancerNames.member.%d')
+    if page_size:
+        params['PageSize'] = page_size
+
+    while True:
+        page = connection.get_list('DescribeLoadBalancers', params, [('member', LoadBalancer)])
+        yield page
+        if not page.next_marker:
+            break
+        params['Marker'] = page.next_marker
+
+def map_elbs(func, names, region, aws_connect_params, concurrency):
+    """
+    Call func(connection, name) for each of the ELBs names using a bounded pool of worker threads.
+
+    boto connections are not thread safe so each worker opens its own connection to ELB.
+
+    Returns:
+        A dict keyed by ELB name of a tuple of what func returned and the error that stopped it, if any
+    """
+    local = threading.local()
+
+    def worker(name):
+        try:
+            connection = getattr(local, 'connection', None)
+            if connection is None:
+                connection = local.connection = connect_to_aws(boto.ec2.elb, region, **aws_connect_params)
+            return name, (func(connection, name), None)
+        except BotoServerError as e:
+            return name, (None, "%s: %s" % (e.error_code, e.error_message))
+        except Exception as e:
+            return name, (None, str(e))
+
+    if not names:
+        return {}
+
+    pool = ThreadPool(max(1, min(concurrency, len(names))))
+    try:
+        return dict(pool.map(worker, names))
+    finally:
+        pool.close()
+        pool.join()
+
+def list_ec2_elbs(connection, module, region, aws_connect_params):
 
     name = module.params.get("name")
+    include_health = module.params.get("include_health")
+    include_tags = module.params.get("include_tags")
+    include_attributes = module.params.get("include_attributes")
+    concurrency = module.params.get("concurrency")
     elb_dict_array = []
 
+    page_size = module.params.get("page_size")
+    if page_size is not None and not 1 <= page_size <= 400:
+        module.fail_json(msg="page_size must be between 1 and 400")
+
     try:
-        all_elbs = connection.get_all_load_balancers(name)
+        elb_filters, tag_filters = make_filter_dict(module.params.get("filters"))
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+
+    # Each page is filtered as it is read, so only the matching ELBs are kept
+    all_elbs = []
+    elbs_tags = {}
+    try:
+        for page in iter_elb_pages(connection, [name] if name else None, page_size):
+            elbs = [elb for elb in page if match_elb(elb, elb_filters)]
+            if elbs and (include_tags or tag_filters):
+                page_tags = get_elbs_tags(connection, [elb.name for elb in elbs])
+                elbs = [elb for elb in elbs if match_tags(page_tags[elb.name], tag_filters)]
+                if include_tags:
+                    for elb in elbs:
+                        elbs_tags[elb.name] = page_tags[elb.name]
+            all_elbs.extend(elbs)
     except BotoServerError as e:
         module.fail_json(msg=e.message)
 
+    names = [elb.name for elb in all_elbs]
+
+    if include_health:
+        elbs_health = map_elbs(get_instance_health, names, region, aws_connect_params, concurrency)
+    if include_attributes:
+        elbs_attributes = map_elbs(get_elb_attributes, names, region, aws_connect_params, concurrency)
+
     for elb in all_elbs:
-        elb_dict_array.append(get_elb_info(elb))
+        if include_health:
+            health, error = elbs_health[elb.name]
+            elb_info = get_elb_info(elb, health)
+            if error:
+                elb_info['health_error'] = error
+        else:
+            elb_info = get_elb_info(elb)
+        if include_tags:
+            elb_info['tags'] = elbs_tags.get(elb.name, {})
+        if include_attributes:
+            attributes, error = elbs_attributes[elb.name]
+            if error:
+                elb_info['attributes_error'] = error
+            else:
+                elb_info['attributes'] = attributes
+        elb_dict_array.append(elb_info)
 
     module.exit_json(elbs=elb_dict_array)
 
@@ -109,7 +437,13 @@ def main():
     argument_spec = ec2_argument_spec()
     argument_spec.update(
         dict(
-            name = dict(default=None, type='str')
+            name = dict(default=None, type='str'),
+            filters = dict(default={}, type='dict'),
+            page_size = dict(default=400, type='int'),
+            include_health = dict(default=False, type='bool'),
+            include_tags = dict(default=False, type='bool'),
+            include_attributes = dict(default=False, type='bool'),
+            concurrency = dict(default=10, type='int')
         )
     )
 
@@ -128,7 +462,7 @@ def main():
     else:
         module.fail_json(msg="region must be specified")
 
-    list_ec2_elbs(connection, module)
+    list_ec2_elbs(connection, module, region, aws_connect_params)
 
 from ansible.module_utils.basic import *
 from ansible.module_utils.ec2 import *
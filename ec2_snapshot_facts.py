@@ -1,218 +1,803 @@
-#!/usr/bin/python
-# This file is part of Ansible
-#
-# Ansible is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-#
-# Ansible is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-# GNU General Public License for more details.
-#
-# You should have received a copy of the GNU General Public License
-# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
-
-DOCUMENTATION = '''
----
-module: ec2_snapshot_facts
-short_description: Gather facts about ec2 volume snapshots in AWS
-description:
-    - Gather facts about ec2 volume snapshots in AWS
-version_added: "2.0"
-author: "Rob White (@wimnat)"
-options:
-  snapshot_ids:
-    description:
-      - A list of one or more snapshot IDs to return
-  filters:
-    description:
-      - A dict of filters to apply. Each dict item consists of a filter key and a filter value. See U(http://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_DescribeSnapshots.html) for possible filters.
-    required: false
-    default: null
-notes:
-  - By default, the module will return all snapshots, including public ones. To limit results to snapshots owned by the account use the filter 'owner-id'.
-
-extends_documentation_fragment:
-    - aws
-    - ec2
-'''
-
-EXAMPLES = '''
-# Note: These examples do not set authentication details, see the AWS Guide for details.
-
-# Gather facts about all snapshots, including public ones
-- ec2_snapshot_facts:
-
-# Gather facts about all snapshots owned by the account 0123456789
-- ec2_snapshot_facts:
-    filters:
-      owner-id: 0123456789
-
-# Gather facts about a particular snapshot using ID
-- ec2_snapshot_facts:
-    filters:
-      snapshot-id: snap-00112233
-
-# Gather facts about any snapshot with a tag key Name and value Example
-- ec2_snapshot_facts:
-    filters:
-      "tag:Name": Example
-
-# Gather facts about any snapshot with an error status
-- ec2_snapshot_facts:
-    filters:
-      status: error
-
-'''
-
-RETURN = '''
-snapshot_id:
-    description: The ID of the snapshot. Each snapshot receives a unique identifier when it is created.
-    type: string
-    sample: snap-01234567
-volume_id:
-    description: The ID of the volume that was used to create the snapshot.
-    type: string
-    sample: vol-01234567
-state:
-    description: The snapshot state (completed, pending or error).
-    type: string
-    sample: completed
-state_message:
-    description: Encrypted Amazon EBS snapshots are copied asynchronously. If a snapshot copy operation fails (for example, if the proper AWS Key Management Service (AWS KMS) permissions are not obtained) this field displays error state details to help you diagnose why the error occurred.
-    type: string
-    sample:
-start_time:
-    description: The time stamp when the snapshot was initiated.
-    type: datetime
-    sample: 2015-02-12T02:14:02+00:00
-progress:
-    description: The progress of the snapshot, as a percentage.
-    type: percentage
-    sample: 100%
-owner_id:
-    description: The AWS account ID of the EBS snapshot owner.
-    type: string
-    sample: 099720109477
-description:
-    description: The description for the snapshot.
-    type: string
-    sample: My important backup
-volume_size:
-    description: The description for the snapshot.
-    type: string
-    sample: My important backup
-owner_alias:
-    description: The description for the snapshot.
-    type: string
-    sample: My important backup
-tags:
-    description: The description for the snapshot.
-    type: string
-    sample: My important backup
-encrypted:
-    description: The description for the snapshot.
-    type: string
-    sample: My important backup
-kms_key_id:
-    description: The description for the snapshot.
-    type: string
-    sample: My important backup
-data_encryption_key_id:
-    description: The description for the snapshot.
-    type: string
-    sample: My important backup
-
-'''
-
-try:
-    import boto3
-    import botocore.exceptions
-    HAS_BOTO3 = True
-except ImportError:
-    HAS_BOTO3 = False
-
-
-def camel_dict_to_snake_dict(camel_dict):
-
-    def camel_to_snake(name):
-
-        import re
-
-        first_cap_re = re.compile('(.)([A-Z][a-z]+)')
-        all_cap_re = re.compile('([a-z0-9])([A-Z])')
-        s1 = first_cap_re.sub(r'\1_\2', name)
-
-        return all_cap_re.sub(r'\1_\2', s1).lower()
-
-    snake_dict = {}
-    for k, v in camel_dict.iteritems():
-        if isinstance(v, dict):
-            v = camel_dict_to_snake_dict(v)
-        snake_dict[camel_to_snake(k)] = v
-
-    return snake_dict
-
-
-def make_filter_list(filters_dict):
-
-    filter_list = []
-
-    for k,v in filters_dict.iteritems():
-        filter_dict = {'Name': k}
-        if isinstance(v, basestring):
-            filter_dict['Values'] = [ v ]
-        else:
-            filter_dict['Values'] = v
-
-        filter_list.append(filter_dict)
-
-    return filter_list
-
-
-def list_ec2_snapshots(connection, module):
-
-    snapshot_ids = module.params.get("snapshot_ids")
-    owner_ids = module.params.get("owner_ids")
-    restorable_by_user_ids = module.params.get("restorable_by_user_ids")
-    filters = make_filter_list(module.params.get("filters"))
-
-    snapshots = connection.describe_snapshots(SnapshotIds=snapshot_ids, OwnerIds=owner_ids, RestorableByUserIds=restorable_by_user_ids, Filters=filters)
-
-    snaked_snapshots = []
-    for snapshot in snapshots['Snapshots']:
-        snaked_snapshots.append(camel_dict_to_snake_dict(snapshot))
-
-    module.exit_json(snapshots=snaked_snapshots)
-
-
-def main():
-
-    argument_spec = ec2_argument_spec()
-    argument_spec.update(
-        dict(
-            snapshot_ids = dict(default=[], type='list'),
-            owner_ids = dict(default=[], type='list'),
-            restorable_by_user_ids = dict(default=[], type='list'),
-            filters = dict(default={}, type='dict')
-        )
-    )
-
-    module = AnsibleModule(argument_spec=argument_spec)
-
-    if not HAS_BOTO3:
-        module.fail_json(msg='boto3 required for this module')
-
-    region, ec2_url, aws_connect_params = get_aws_connection_info(module, boto3=True)
-
-    connection = boto3_conn(module, conn_type='client', resource='ec2', region=region, endpoint=ec2_url, **aws_connect_params)
-
-    list_ec2_snapshots(connection, module)
-
-from ansible.module_utils.basic import *
-from ansible.module_utils.ec2 import *
-
-if __name__ == '__main__':
-    main()
+#!/usr/bin/python
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION = '''
+---
+module: ec2_snapshot_facts
+short_description: Gather facts about ec2 volume snapshots in AWS
+description:
+    - Gather facts about ec2 volume snapshots in AWS
+version_added: "2.0"
+author: "Rob White (@wimnat)"
+options:
+  snapshot_ids:
+    description:
+      - A list of one or more snapshot IDs to return
+  filters:
+    description:
+      - A dict of filters to apply. Each dict item consists of a filter key and a filter value. See U(http://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_DescribeSnapshots.html) for possible filters.
+    required: false
+    default: null
+  max_results:
+    description:
+      - The number of snapshots to request in each page of results. Snapshots are requested a page at a time until
+        there are no more, or until enough have been found for C(limit). Ignored when C(snapshot_ids) is given.
+    required: false
+    default: 1000
+    version_added: "2.1"
+  limit:
+    description:
+      - The most snapshots to return. Without C(sort_by), no further pages are requested once this many snapshots
+        have been found.
+    required: false
+    default: null
+    version_added: "2.1"
+  sort_by:
+    description:
+      - The key to sort the returned snapshots by. Sorting reads every page of results; with C(limit) only the
+        first C(limit) snapshots in sort order are kept while doing so.
+    required: false
+    default: null
+    choices: ['start_time', 'volume_size', 'snapshot_id', 'volume_id']
+    version_added: "2.1"
+  sort_order:
+    description:
+      - Whether C(sort_by) sorts in ascending or descending order.
+    required: false
+    default: descending
+    choices: ['ascending', 'descending']
+    version_added: "2.1"
+  newest_n:
+    description:
+      - Return only this many of the most recently started snapshots, newest first. The same as C(sort_by=start_time)
+        and C(limit) together. Cannot be used with C(sort_by) or C(limit).
+    required: false
+    default: null
+    version_added: "2.1"
+  cache_path:
+    description:
+      - The path of a JSON file to keep snapshot listings in between runs, keyed by region, C(snapshot_ids),
+        C(owner_ids), C(restorable_by_user_ids) and C(filters). Later runs only fetch snapshots started on or after
+        the day of the latest cached snapshot (or of the earliest cached pending snapshot) and merge them into the
+        cache.
+      - Returns C(cache) with C(refreshed), true if a full listing was made, and C(fetched), the number of snapshots
+        described. Times of cached snapshots are returned as ISO 8601 strings.
+    required: false
+    default: null
+    version_added: "2.1"
+  cache_ttl:
+    description:
+      - With C(cache_path), how many seconds a listing is updated incrementally before it is refreshed in full.
+        Deleted snapshots are only dropped from the cache by a full refresh. A full refresh is also made when the
+        latest cached snapshot is more than 60 days old, or when C(filters) include C(start-time).
+    required: false
+    default: 86400
+    version_added: "2.1"
+  summarize:
+    description:
+      - Instead of the snapshots, return C(volumes), a dict keyed by volume id of the C(count) and C(total_size) of
+        the snapshots of each volume and the C(snapshot_id) and C(start_time) of the C(oldest) and C(newest).
+        Cannot be used with C(sort_by), C(limit) or C(newest_n).
+    required: false
+    default: null
+    choices: ['by_volume']
+    version_added: "2.1"
+  retention:
+    description:
+      - With C(summarize), a retention policy to apply to the completed snapshots of each volume, a dict of
+        C(daily), C(weekly) and C(monthly). The newest snapshot of each of the latest C(daily) days, C(weekly)
+        ISO weeks and C(monthly) months that have a snapshot is kept, and the ids of the others are returned in
+        C(prune) for each volume, newest first.
+    required: false
+    default: null
+    version_added: "2.1"
+  regions:
+    description:
+      - A list of regions to gather snapshot facts from concurrently, with one connection per region, or C(all)
+        for every region available to the account. Instead of the results of a single region, returns C(regions),
+        a dict keyed by region of the results of each region with the seconds they took in C(elapsed).
+      - A region that fails has C(failed) and C(msg) set in its results and is listed in C(failed_regions); the
+        task only fails if every region does.
+    required: false
+    default: null
+    version_added: "2.1"
+  fields:
+    description:
+      - A list of the snapshot keys to return, such as C(snapshot_id), C(volume_id) and C(start_time). Only these
+        keys of each snapshot are converted and returned. Cannot be used with C(summarize).
+    required: false
+    default: null
+    version_added: "2.1"
+  output_format:
+    description:
+      - How to return the snapshots. C(list) returns a list of dicts, one per snapshot. C(columnar) returns a dict
+        keyed by snapshot key of lists of the values of each snapshot, in the same order, with null for a snapshot
+        without the key. Cannot be used with C(summarize).
+    required: false
+    default: list
+    choices: ['list', 'columnar']
+    version_added: "2.1"
+notes:
+  - By default, the module will return all snapshots, including public ones. To limit results to snapshots owned by the account use the filter 'owner-id'.
+
+extends_documentation_fragment:
+    - aws
+    - ec2
+'''
+
+EXAMPLES = '''
+# Note: These examples do not set authentication details, see the AWS Guide for details.
+
+# Gather facts about all snapshots, including public ones
+- ec2_snapshot_facts:
+
+# Gather facts about all snapshots owned by the account 0123456789
+- ec2_snapshot_facts:
+    filters:
+      owner-id: 0123456789
+
+# Gather facts about a particular snapshot using ID
+- ec2_snapshot_facts:
+    filters:
+      snapshot-id: snap-00112233
+
+# Gather facts about any snapshot with a tag key Name and value Example
+- ec2_snapshot_facts:
+    filters:
+      "tag:Name": Example
+
+# Gather facts about any snapshot with an error status
+- ec2_snapshot_facts:
+    filters:
+      status: error
+
+# Gather facts about the 5 latest snapshots of a volume
+- ec2_snapshot_facts:
+    filters:
+      volume-id: vol-00112233
+    newest_n: 5
+
+# Gather facts about the first 100 snapshots owned by the account 0123456789, 100 at a time
+- ec2_snapshot_facts:
+    filters:
+      owner-id: 0123456789
+    max_results: 100
+    limit: 100
+
+# Find the snapshots of each volume that a 7 daily, 4 weekly and 12 monthly retention policy would prune
+- ec2_snapshot_facts:
+    filters:
+      owner-id: 0123456789
+    summarize: by_volume
+    retention:
+      daily: 7
+      weekly: 4
+      monthly: 12
+  register: snapshot_summary
+
+# Summarise the snapshots of the account in every region
+- ec2_snapshot_facts:
+    filters:
+      owner-id: 0123456789
+    regions: all
+    summarize: by_volume
+
+# Gather only the ids, volumes and start times of the snapshots of the account, as lists
+- ec2_snapshot_facts:
+    filters:
+      owner-id: 0123456789
+    fields:
+      - snapshot_id
+      - volume_id
+      - start_time
+    output_format: columnar
+
+# Keep the snapshots of the account in a local cache, fetching only new ones and refreshing it in full hourly
+- ec2_snapshot_facts:
+    filters:
+      owner-id: 0123456789
+    cache_path: /var/cache/ansible/snapshots.json
+    cache_ttl: 3600
+
+'''
+
+RETURN = '''
+snapshot_id:
+    description: The ID of the snapshot. Each snapshot receives a unique identifier when it is created.
+    type: string
+    sample: snap-01234567
+volume_id:
+    description: The ID of the volume that was used to create the snapshot.
+    type: string
+    sample: vol-01234567
+state:
+    description: The snapshot state (completed, pending or error).
+    type: string
+    sample: completed
+state_message:
+    description: Encrypted Amazon EBS snapshots are copied asynchronously. If a snapshot copy operation fails (for example, if the proper AWS Key Management Service (AWS KMS) permissions are not obtained) this field displays error state details to help you diagnose why the error occurred.
+    type: string
+    sample:
+start_time:
+    description: The time stamp when the snapshot was initiated.
+    type: datetime
+    sample: 2015-02-12T02:14:02+00:00
+progress:
+    description: The progress of the snapshot, as a percentage.
+    type: percentage
+    sample: 100%
+owner_id:
+    description: The AWS account ID of the EBS snapshot owner.
+    type: string
+    sample: 099720109477
+description:
+    description: The description for the snapshot.
+    type: string
+    sample: My important backup
+volume_size:
+    description: The description for the snapshot.
+    type: string
+    sample: My important backup
+owner_alias:
+    description: The description for the snapshot.
+    type: string
+    sample: My important backup
+tags:
+    description: The description for the snapshot.
+    type: string
+    sample: My important backup
+encrypted:
+    description: The description for the snapshot.
+    type: string
+    sample: My important backup
+kms_key_id:
+    description: The description for the snapshot.
+    type: string
+    sample: My important backup
+data_encryption_key_id:
+    description: The description for the snapshot.
+    type: string
+    sample: My important backup
+
+'''
+
+import datetime
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import boto3
+    import botocore.exceptions
+    HAS_BOTO3 = True
+except ImportError:
+    HAS_BOTO3 = False
+
+FIRST_CAP_RE = re.compile('(.)([A-Z][a-z]+)')
+ALL_CAP_RE = re.compile('([a-z0-9])([A-Z])')
+
+# The most days of snapshots a cache_path delta fetches, one start-time filter value per day. Older
+# caches are refreshed in full.
+MAX_DELTA_DAYS = 60
+
+# The most regions to gather snapshot facts from at the same time
+MAX_REGION_THREADS = 16
+
+# Snapshots share a handful of keys, so their snake case names are remembered, up to this many
+SNAKE_CACHE_SIZE = 1024
+snake_cache = {}
+
+
+def camel_to_snake(name):
+
+    snake = snake_cache.get(name)
+    if snake is None:
+        snake = ALL_CAP_RE.sub(r'\1_\2', FIRST_CAP_RE.sub(r'\1_\2', name)).lower()
+        if len(snake_cache) < SNAKE_CACHE_SIZE:
+            snake_cache[name] = snake
+
+    return snake
+
+
+def camel_dict_to_snake_dict(camel_dict):
+    """
+    Convert the keys of camel_dict to snake case, along with those of any dicts nested in it, including
+    dicts in lists such as Tags. Nesting is handled with a stack rather than recursion.
+    """
+
+    stack = []
+
+    def copy(value):
+        if isinstance(value, dict):
+            converted = {}
+        elif isinstance(value, list):
+            converted = [None] * len(value)
+        else:
+            return value
+        stack.append((value, converted))
+        return converted
+
+    snake_dict = copy(camel_dict)
+    while stack:
+        value, converted = stack.pop()
+        if isinstance(value, dict):
+            for k, v in value.iteritems():
+                converted[camel_to_snake(k)] = copy(v)
+        else:
+            for i, v in enumerate(value):
+                converted[i] = copy(v)
+
+    return snake_dict
+
+
+def make_filter_list(filters_dict):
+
+    filter_list = []
+
+    for k,v in filters_dict.iteritems():
+        filter_dict = {'Name': k}
+        if isinstance(v, basestring):
+            filter_dict['Values'] = [ v ]
+        else:
+            filter_dict['Values'] = v
+
+        filter_list.append(filter_dict)
+
+    return filter_list
+
+
+def iter_snapshots(connection, params, max_results, fields=None):
+    """
+    Yield snake cased snapshots from DescribeSnapshots, requesting pages of max_results and following
+    NextToken. Each page is converted as it is consumed and the next page is only requested once the
+    previous one has been, so a consumer that stops early stops the paging too.
+
+    Given fields, a collection of snake case keys, only those keys of each snapshot are converted and
+    yielded.
+    """
+
+    params = dict(params)
+    # DescribeSnapshots does not accept MaxResults together with SnapshotIds
+    if max_results and not params.get('SnapshotIds'):
+        params['MaxResults'] = max_results
+
+    while True:
+        response = connection.describe_snapshots(**params)
+        for snapshot in response['Snapshots']:
+            if fields:
+                snapshot = dict((k, v) for k, v in snapshot.iteritems() if camel_to_snake(k) in fields)
+            yield camel_dict_to_snake_dict(snapshot)
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+        params['NextToken'] = next_token
+
+
+def select_snapshots(snapshots, sort_by=None, sort_order='descending', limit=None):
+    """
+    Sort snapshots by sort_by and keep at most limit of them, consuming no more of snapshots than needed.
+
+    The first limit of a sorted selection are kept with a heap of limit snapshots, so memory use does not
+    depend on how many snapshots there are.
+    """
+
+    if not sort_by:
+        if limit:
+            return list(itertools.islice(snapshots, limit))
+        return list(snapshots)
+
+    key = lambda snapshot: snapshot.get(sort_by)
+    if not limit:
+        return sorted(snapshots, key=key, reverse=(sort_order == 'descending'))
+    if sort_order == 'descending':
+        return heapq.nlargest(limit, snapshots, key=key)
+    return heapq.nsmallest(limit, snapshots, key=key)
+
+
+def project_snapshots(snapshots, fields):
+    """
+    Yield copies of snake cased snapshots with only the keys in fields.
+    """
+
+    for snapshot in snapshots:
+        yield dict((k, v) for k, v in snapshot.iteritems() if k in fields)
+
+
+def to_columns(snapshots, fields=None):
+    """
+    Turn a list of snapshots into a dict keyed by snapshot key of the values of each snapshot, in order,
+    with None for a snapshot without the key. Without fields, every key of any of the snapshots is used.
+    """
+
+    if not fields:
+        fields = set(k for snapshot in snapshots for k in snapshot)
+
+    return dict((field, [snapshot.get(field) for snapshot in snapshots]) for field in fields)
+
+
+class SnapshotCache(object):
+    """
+    Snapshot listings kept in a JSON file between runs, keyed by cache_key.
+
+    Each entry holds the snapshots of the last listing, with times as ISO 8601 strings, and when that
+    listing was last refreshed in full.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+
+    def save(self):
+        # Write to a temporary file and rename it over the cache so a failed write never leaves it truncated
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot_cache')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.entries, f)
+        os.rename(temp_path, self.path)
+
+
+def cache_key(region, params):
+
+    key = [region] + [sorted(params.get(name) or []) for name in ('SnapshotIds', 'OwnerIds', 'RestorableByUserIds')]
+    key.append(sorted((f['Name'], sorted(f['Values'])) for f in params.get('Filters') or []))
+
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def to_json_value(snapshot):
+
+    return json.loads(json.dumps(snapshot, default=lambda value: value.isoformat()))
+
+
+def get_delta_days(entry):
+    """
+    The days to fetch snapshots for to bring a cache entry up to date: those from the day of its latest
+    snapshot, or of its earliest pending one if that is earlier, up to today.
+
+    Returns:
+        A list of YYYY-MM-DD strings, or None if there are too many days to fetch
+    """
+
+    start_times = [snapshot['start_time'] for snapshot in entry['snapshots']]
+    if not start_times:
+        return None
+    since = max(start_times)
+    pending = [snapshot['start_time'] for snapshot in entry['snapshots'] if snapshot.get('state') == 'pending']
+    if pending:
+        since = min(since, min(pending))
+
+    day = datetime.datetime.strptime(since[:10], '%Y-%m-%d').date()
+    today = datetime.datetime.utcnow().date()
+    if (today - day).days >= MAX_DELTA_DAYS:
+        return None
+
+    days = []
+    while day <= today:
+        days.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def get_cached_snapshots(connection, params, max_results, cache, key, ttl):
+    """
+    Bring the cache entry for key up to date and return its snapshots.
+
+    A full listing is made when there is no entry or it was last refreshed in full more than ttl seconds
+    ago; this is also what drops deleted snapshots. Otherwise only the snapshots started on or after the
+    day of the latest cached one, or of the earliest pending one, are fetched, using a wildcard start-time
+    filter, and merged into the entry by snapshot id.
+
+    Returns:
+        A tuple of (snapshots, refreshed, fetched) where refreshed is True for a full listing and fetched
+        is the number of snapshots described
+    """
+
+    entry = cache.get(key)
+    days = None
+    filter_names = [f['Name'] for f in params.get('Filters') or []]
+    if entry is not None and time.time() - entry['refreshed'] < ttl and 'start-time' not in filter_names:
+        days = get_delta_days(entry)
+
+    if days is None:
+        snapshots = [to_json_value(snapshot) for snapshot in iter_snapshots(connection, params, max_results)]
+        entry = dict(refreshed=time.time(), snapshots=snapshots)
+        fetched = len(snapshots)
+    else:
+        delta_params = dict(params)
+        delta_params['Filters'] = list(params.get('Filters') or []) + [{'Name': 'start-time',
+                                                                         'Values': [day + '*' for day in days]}]
+        snapshots = dict((snapshot['snapshot_id'], snapshot) for snapshot in entry['snapshots'])
+        fetched = 0
+        for snapshot in iter_snapshots(connection, delta_params, max_results):
+            snapshots[snapshot['snapshot_id']] = to_json_value(snapshot)
+            fetched += 1
+        entry['snapshots'] = list(snapshots.values())
+
+    cache.put(key, entry)
+    return entry['snapshots'], days is None, fetched
+
+
+def get_start_time(snapshot):
+
+    start_time = snapshot['start_time']
+    if isinstance(start_time, basestring):
+        # Cached snapshots have ISO 8601 start times
+        return datetime.datetime.strptime(start_time[:19], '%Y-%m-%dT%H:%M:%S')
+    return start_time.replace(tzinfo=None)
+
+
+def get_retained(snapshots, retention):
+    """
+    Find which of snapshots, newest first, a retention policy keeps: the newest snapshot of each of the
+    latest retention['daily'] days, retention['weekly'] ISO weeks and retention['monthly'] months that
+    have a snapshot.
+
+    Returns:
+        A set of the snapshot ids to keep
+    """
+
+    periods = {
+        'daily': lambda start: start.date(),
+        'weekly': lambda start: start.isocalendar()[:2],
+        'monthly': lambda start: (start.year, start.month),
+    }
+
+    keep = set()
+    for name, period in periods.items():
+        count = int(retention.get(name) or 0)
+        seen = set()
+        for start, snapshot_id in snapshots:
+            if len(seen) >= count:
+                break
+            key = period(start)
+            if key not in seen:
+                seen.add(key)
+                keep.add(snapshot_id)
+
+    return keep
+
+
+def summarize_by_volume(snapshots, retention=None):
+    """
+    Summarise snapshots per volume: how many there are, their total size, the oldest and newest and, given
+    a retention policy, which completed snapshots it would prune.
+
+    Only the start time, id, size and state of each snapshot are kept while reading snapshots.
+    """
+
+    index = {}
+    for snapshot in snapshots:
+        index.setdefault(snapshot.get('volume_id'), []).append(
+            (get_start_time(snapshot), snapshot['snapshot_id'], snapshot.get('volume_size') or 0,
+             snapshot.get('state'), snapshot['start_time']))
+
+    summary = {}
+    for volume_id, volume_snapshots in index.items():
+        volume_snapshots.sort(reverse=True)
+        newest, oldest = volume_snapshots[0], volume_snapshots[-1]
+        volume_summary = {
+            'count': len(volume_snapshots),
+            'total_size': sum(size for start, snapshot_id, size, state, start_time in volume_snapshots),
+            'newest': dict(snapshot_id=newest[1], start_time=newest[4]),
+            'oldest': dict(snapshot_id=oldest[1], start_time=oldest[4])
+        }
+        if retention:
+            completed = [(start, snapshot_id) for start, snapshot_id, size, state, start_time in volume_snapshots
+                         if state == 'completed']
+            keep = get_retained(completed, retention)
+            volume_summary['prune'] = [snapshot_id for start, snapshot_id in completed if snapshot_id not in keep]
+        summary[volume_id] = volume_summary
+
+    return summary
+
+
+def get_snapshot_facts(connection, region, params, options, cache=None):
+    """
+    Gather the snapshot facts of one region, as the snapshots selected by options or their summary.
+    """
+
+    fields = options['fields']
+    sort_by = options['sort_by']
+    # The key to sort by is read along with fields and dropped once the snapshots are sorted
+    read_fields = None
+    if fields:
+        read_fields = set(fields)
+        if sort_by:
+            read_fields.add(sort_by)
+
+    if cache is not None:
+        # The cache keeps whole snapshots, so that it serves any fields
+        snapshots, refreshed, fetched = get_cached_snapshots(connection, params, options['max_results'], cache,
+                                                             cache_key(region, params), options['cache_ttl'])
+        if read_fields:
+            snapshots = project_snapshots(snapshots, read_fields)
+    else:
+        snapshots = iter_snapshots(connection, params, options['max_results'], read_fields)
+
+    if options['summarize'] == 'by_volume':
+        result = dict(volumes=summarize_by_volume(snapshots, options['retention']))
+    else:
+        snapshots = select_snapshots(snapshots, sort_by, options['sort_order'], options['limit'])
+        if fields and sort_by and sort_by not in fields:
+            for snapshot in snapshots:
+                snapshot.pop(sort_by, None)
+        if options['output_format'] == 'columnar':
+            snapshots = to_columns(snapshots, fields)
+        result = dict(snapshots=snapshots)
+
+    if cache is not None:
+        result['cache'] = dict(refreshed=refreshed, fetched=fetched)
+    return result
+
+
+def get_region_snapshot_facts(module, regions, ec2_url, aws_connect_params, params, options, cache=None):
+    """
+    Gather the snapshot facts of each of regions concurrently, with one client per region.
+
+    Returns:
+        A dict keyed by region of the facts of each region along with the seconds it took in elapsed, or
+        the error that stopped it in msg
+    """
+
+    def worker(region):
+        start = time.time()
+        try:
+            connection = boto3_conn(module, conn_type='client', resource='ec2', region=region, endpoint=ec2_url,
+                                    **aws_connect_params)
+            result = get_snapshot_facts(connection, region, params, options, cache)
+        except Exception as e:
+            result = dict(failed=True, msg=str(e))
+        result['elapsed'] = round(time.time() - start, 2)
+        return region, result
+
+    pool = ThreadPool(max(1, min(MAX_REGION_THREADS, len(regions))))
+    try:
+        return dict(pool.map(worker, regions))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def list_ec2_snapshots(connection, module, region, ec2_url, aws_connect_params):
+
+    snapshot_ids = module.params.get("snapshot_ids")
+    owner_ids = module.params.get("owner_ids")
+    restorable_by_user_ids = module.params.get("restorable_by_user_ids")
+    filters = make_filter_list(module.params.get("filters"))
+    sort_by = module.params.get("sort_by")
+    sort_order = module.params.get("sort_order")
+    limit = module.params.get("limit")
+    regions = module.params.get("regions")
+
+    summarize = module.params.get("summarize")
+    retention = module.params.get("retention")
+    fields = module.params.get("fields")
+    output_format = module.params.get("output_format")
+
+    newest_n = module.params.get("newest_n")
+    if newest_n:
+        if sort_by or limit:
+            module.fail_json(msg="newest_n cannot be used together with sort_by or limit")
+        sort_by, sort_order, limit = 'start_time', 'descending', newest_n
+
+    if summarize and (sort_by or limit):
+        module.fail_json(msg="summarize cannot be used together with sort_by, limit or newest_n")
+    if summarize and (fields or output_format != 'list'):
+        module.fail_json(msg="summarize cannot be used together with fields or output_format")
+    if retention:
+        if not summarize:
+            module.fail_json(msg="retention requires summarize")
+        unknown = set(retention.keys()) - set(['daily', 'weekly', 'monthly'])
+        if unknown:
+            module.fail_json(msg="Unsupported keys in retention: %s" % ', '.join(sorted(unknown)))
+
+    params = dict(SnapshotIds=snapshot_ids, OwnerIds=owner_ids, RestorableByUserIds=restorable_by_user_ids, Filters=filters)
+    options = dict(max_results=module.params.get("max_results"), cache_ttl=module.params.get("cache_ttl"),
+                   sort_by=sort_by, sort_order=sort_order, limit=limit, summarize=summarize, retention=retention,
+                   fields=fields, output_format=output_format)
+
+    cache_path = module.params.get("cache_path")
+    cache = None
+    try:
+        if cache_path:
+            cache = SnapshotCache(cache_path)
+
+        if regions:
+            if regions == ['all']:
+                regions = sorted(r['RegionName'] for r in connection.describe_regions()['Regions'])
+            results = get_region_snapshot_facts(module, regions, ec2_url, aws_connect_params, params, options, cache)
+        else:
+            result = get_snapshot_facts(connection, region, params, options, cache)
+
+        if cache is not None:
+            cache.save()
+    except botocore.exceptions.ClientError as e:
+        module.fail_json(msg=str(e))
+    except (IOError, OSError) as e:
+        module.fail_json(msg="Could not write cache_path %s: %s" % (cache_path, str(e)))
+
+    if not regions:
+        module.exit_json(**result)
+
+    failed = sorted(name for name, region_result in results.items() if region_result.get('failed'))
+    if len(failed) == len(results):
+        module.fail_json(msg="Gathering snapshot facts failed in every region", regions=results)
+    module.exit_json(regions=results, failed_regions=failed)
+
+
+def main():
+
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(
+        dict(
+            snapshot_ids = dict(default=[], type='list'),
+            owner_ids = dict(default=[], type='list'),
+            restorable_by_user_ids = dict(default=[], type='list'),
+            filters = dict(default={}, type='dict'),
+            max_results = dict(default=1000, type='int'),
+            limit = dict(type='int'),
+            sort_by = dict(choices=['start_time', 'volume_size', 'snapshot_id', 'volume_id']),
+            sort_order = dict(default='descending', choices=['ascending', 'descending']),
+            newest_n = dict(type='int'),
+            cache_path = dict(),
+            cache_ttl = dict(default=86400, type='int'),
+            summarize = dict(choices=['by_volume']),
+            retention = dict(type='dict'),
+            regions = dict(type='list'),
+            fields = dict(type='list'),
+            output_format = dict(default='list', choices=['list', 'columnar'])
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec)
+
+    if not HAS_BOTO3:
+        module.fail_json(msg='boto3 required for this module')
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module, boto3=True)
+    if module.params.get('regions') and not region:
+        # Only used to look up the regions with regions=all
+        region = 'us-east-1'
+
+    connection = boto3_conn(module, conn_type='client', resource='ec2', region=region, endpoint=ec2_url, **aws_connect_params)
+
+    list_ec2_snapshots(connection, module, region, ec2_url, aws_connect_params)
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,7 @@ DOCUMENTATION = '''
 module: ec2_vol
 short_description: create and attach a volume, return volume id and device map
 description:
-    - creates an EBS volume and optionally attaches it to an instance.  If both an instance ID and a device name is given and the instance has a device at the device name, then no volume is created and no attachment is made.  This module has a dependency on python-boto.
+    - creates an EBS volume and optionally attaches it to an instance.  If both an instance ID and a device name is given and the instance has a device at the device name, then no volume is created and no attachment is made.  This module has a dependency on python-boto3.
 version_added: "1.1"
 options:
   instance:
@@ -46,10 +46,14 @@ options:
     default: null
   volume_type:
     description:
-      - Type of EBS volume; standard (magnetic), gp2 (SSD), io1 (Provisioned IOPS). "Standard" is the old EBS default
+      - Type of EBS volume; standard (magnetic), gp2 and gp3 (SSD), io1 and io2 (Provisioned IOPS), st1 (throughput
+        optimized HDD) or sc1 (cold HDD). "Standard" is the old EBS default
         and continues to remain the Ansible default for backwards compatibility. 
+      - When not set, new volumes are created as standard (io1 if C(iops) is set) and the type of existing volumes
+        is left alone.
     required: false
-    default: standard
+    default: null
+    choices: ['standard', 'gp2', 'gp3', 'io1', 'io2', 'st1', 'sc1']
     version_added: "1.9"
   iops:
     description:
@@ -64,7 +68,8 @@ options:
     version_added: "1.8"
   device_name:
     description:
-      - device id to override device mapping. Assumes /dev/sdf for Linux/UNIX and /dev/xvdf for Windows.
+      - device id to override device mapping. If not set, the first device name not already mapped on the instance
+        is used, from /dev/sd[f-p] for Linux/UNIX and /dev/xvd[f-z] for Windows.
     required: false
     default: null
   region:
@@ -95,10 +100,199 @@ options:
   state:
     description: 
       - whether to ensure the volume is present or absent, or to list existing volumes (The C(list) option was added in version 1.8).
+      - C(report) summarises the unattached volumes matching C(filters) and C(zone) instead of listing them. The
+        C(report) result has the count, total size in GiB and estimated monthly cost of the volumes overall and by
+        type, zone, age (C(0-7d), C(7-30d), C(30-90d), C(90-365d) and C(365d+)) and value of the C(owner_tag) tag.
+        Volumes of a type without a price are counted in C(unpriced). (The C(report) option was added in version 2.1.)
     required: false
     default: present
-    choices: ['absent', 'present', 'list']
+    choices: ['absent', 'present', 'list', 'report']
     version_added: "1.6"
+  volumes:
+    description:
+      - A list of volume specifications to create and attach in a single task. Each item is a dict which accepts the
+        keys C(instance), C(id), C(name), C(volume_size), C(volume_type), C(iops), C(throughput), C(encrypted),
+        C(device_name), C(zone), C(snapshot), C(modify), C(performance) and C(client_token). Any key not given in an
+        item is taken from the module option of the same name.
+      - Items are processed concurrently. A failure in one item does not stop the others; the task fails after all
+        items have been processed if any of them failed.
+      - Only supported with C(state=present).
+    required: false
+    default: null
+    version_added: "2.1"
+  instances:
+    description:
+      - A list of instance ids to create a volume for and attach it to, each as described by the other options.
+        Results are returned per instance as with C(volumes).
+      - All instances are looked up together with a few paginated DescribeInstances calls, rather than one call
+        per instance. The same applies to the instances of C(volumes) items.
+      - With C(name), each instance only reuses a volume of that name already attached to it; otherwise a new
+        volume is created for it.
+      - Only supported with C(state=present). Cannot be used with C(instance), C(id) or C(client_token).
+    required: false
+    default: null
+    version_added: "2.1"
+  concurrency:
+    description:
+      - The maximum number of items in C(volumes) or C(instances), or of volumes to delete, to process at the same
+        time. All of them share one connection pool of at least this size.
+    required: false
+    default: 10
+    version_added: "2.1"
+  wait_timeout:
+    description:
+      - How many seconds to wait for volumes to become available, attached or detached before failing.
+        All volumes in a task are waited on together, with a single API call per poll.
+      - The number of seconds each volume took to reach each state is returned in C(wait_times).
+    required: false
+    default: 300
+    version_added: "2.1"
+  filters:
+    description:
+      - With C(state=list), C(state=report) or C(state=absent), a dict of DescribeVolumes filters to apply on the
+        server, e.g. C(status), C(volume-type), C(attachment.status) or C(tag:Name). See
+        U(http://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_DescribeVolumes.html) for possible filters.
+        C(instance) and C(zone), if given, are added as the C(attachment.instance-id) and C(availability-zone) filters.
+      - With C(state=absent), every volume matching the filters is deleted. Cannot be used with C(id) or
+        C(volume_ids).
+    required: false
+    default: null
+    version_added: "2.1"
+  page_size:
+    description:
+      - With C(state=list), C(state=report) or C(state=absent), the number of volumes to request per
+        DescribeVolumes call (5 to 500).
+    required: false
+    default: 500
+    version_added: "2.1"
+  limit:
+    description:
+      - With C(state=list), the maximum number of volumes to return. No further pages are requested once the limit
+        is reached and C(truncated) is set in the result to show that more volumes may exist.
+    required: false
+    default: null
+    version_added: "2.1"
+  fields:
+    description:
+      - With C(state=list), the keys to return for each volume. Returns every key if not set.
+    required: false
+    default: null
+    choices: ['create_time', 'id', 'iops', 'throughput', 'size', 'snapshot_id', 'status', 'type', 'zone',
+              'attachment_set', 'tags']
+    version_added: "2.1"
+  modify:
+    description:
+      - Whether to change the size, type or IOPS of an existing volume, found by C(id) or C(name), in place with
+        ModifyVolume when they differ from C(volume_size), C(volume_type) or C(iops). Volumes can grow but not shrink.
+      - The modification is returned in C(modification), including its state and progress percentage.
+    required: false
+    default: false
+    version_added: "2.1"
+  modification_wait:
+    description:
+      - Which state to wait for a modification to reach. The new size can be used once the modification is
+        C(optimizing), while C(completed) waits for the volume to reach its full new performance, which can take
+        a long time for large volumes. C(none) returns as soon as the modification has been requested.
+    required: false
+    default: optimizing
+    choices: ['none', 'optimizing', 'completed']
+    version_added: "2.1"
+  throughput:
+    description:
+      - The throughput in MB/s to provision for a gp3 volume (integer).
+    required: false
+    default: null
+    version_added: "2.1"
+  performance:
+    description:
+      - A performance profile to size a new volume from, instead of giving C(volume_type), C(volume_size), C(iops)
+        and C(throughput). Accepts the keys C(iops) (target IOPS), C(throughput) (target MB/s), C(min_size) (GiB)
+        and C(types), a list of the volume types to consider which defaults to every current generation type.
+      - The cheapest volume type, size, IOPS and throughput that meet the targets are chosen using built-in limits
+        and us-east-1 prices and returned in C(sizing), along with the headroom over each target.
+    required: false
+    default: null
+    version_added: "2.1"
+  stripe_set:
+    description:
+      - Create a set of identical volumes and attach them all to C(instance), for striping. Accepts the keys
+        C(name) (required, the value of the StripeSet tag shared by the members), C(count) (required),
+        C(volume_size), C(volume_type), C(iops), C(throughput) and C(devices), a list of one device name per
+        member. Without C(devices), free device names are chosen in member order.
+      - Members are tagged with StripeSet, StripeSetMember (their index) and a Name of C(name)-index. On later runs
+        existing members are found by these tags and only missing members are created or attached. Members with an
+        index of C(count) or more are not touched and are reported in C(extra_volume_ids).
+      - Returns C(stripe_set) with the member volume ids and devices in member order and the aggregate size, IOPS
+        and throughput.
+    required: false
+    default: null
+    version_added: "2.1"
+  client_token:
+    description:
+      - The idempotency token to create the volume with. By default a token is derived from the options that
+        describe the volume, so retrying a task after a timeout returns the volume created by the first attempt
+        rather than a duplicate. That volume is then treated as an existing volume, and the task fails if it has
+        since been deleted. Set this to create a further volume identical to one created by an earlier run
+        within EC2's idempotency window.
+      - With C(volumes) or C(stripe_set), a distinct token is derived from this one for each item or member that
+        does not set its own C(client_token).
+    required: false
+    default: null
+    version_added: "2.1"
+  volume_ids:
+    description:
+      - With C(state=absent), a list of volume ids to delete, in addition to C(id). Volumes that do not exist are
+        reported in C(absent).
+      - With C(state=absent), attached volumes are detached first and all of them are waited on together. The
+        deletes are then made concurrently, up to C(concurrency) at a time and at most C(delete_rate) per second.
+        The result lists the ids that were C(deleted) or already C(absent), and the id and error of each of the
+        C(failures).
+    required: false
+    default: null
+    version_added: "2.1"
+  force_detach:
+    description:
+      - Force the detachment of attached volumes before deleting them with C(state=absent). See the
+        C(Force) parameter of U(http://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_DetachVolume.html).
+    required: false
+    default: false
+    version_added: "2.1"
+  delete_rate:
+    description:
+      - The most DeleteVolume calls to make per second with C(state=absent).
+    required: false
+    default: 10
+    version_added: "2.1"
+  owner_tag:
+    description:
+      - With C(state=report), the tag whose value volumes are grouped by in C(by_owner). Volumes without the tag
+        are grouped as C(untagged).
+    required: false
+    default: Owner
+    version_added: "2.1"
+  prices:
+    description:
+      - With C(state=report), prices to use instead of the built in on-demand prices, by volume type. A price is
+        either the price per GiB-month or a dict of C(gib_month), C(iops_month) and C(throughput_month).
+    required: false
+    default: null
+    version_added: "2.1"
+  max_attempts:
+    description:
+      - The most attempts made at each EC2 API call, including the first. Calls are retried with botocore's adaptive
+        retry mode, which also slows all calls down while EC2 is throttling requests, so that large concurrent runs
+        back off rather than fail on RequestLimitExceeded.
+    required: false
+    default: 10
+    version_added: "2.1"
+  instrumentation:
+    description:
+      - Return a C(metrics) dict with the number of calls, errors and retries and the total, median (p50) and
+        95th percentile (p95) latency in seconds of each EC2 API operation the module made, along with the number
+        of sleeps and the time spent sleeping while waiting on volumes. Retries are those made by botocore.
+    required: false
+    default: false
+    version_added: "2.1"
 author: "Lester Wade (@lwade)"
 extends_documentation_fragment: aws
 '''
@@ -161,6 +355,18 @@ EXAMPLES = '''
     id: vol-XXXXXXXX
     state: absent
 
+# Delete every unattached volume tagged as scratch space, and the volumes of a decommissioned cluster,
+# forcing them off their instances
+- ec2_vol:
+    state: absent
+    filters:
+      status: available
+      "tag:Purpose": scratch
+- ec2_vol:
+    state: absent
+    volume_ids: "{{ cluster_volume_ids }}"
+    force_detach: yes
+
 # Detach a volume (since 1.9)
 - ec2_vol:
     id: vol-XXXXXXXX
@@ -171,325 +377,1827 @@ EXAMPLES = '''
     instance: i-XXXXXX
     state: list
 
+# List the ids and sizes of the first 100 unattached gp2 volumes in a zone
+- ec2_vol:
+    state: list
+    zone: us-east-1a
+    filters:
+      status: available
+      volume-type: gp2
+    limit: 100
+    fields: ['id', 'size']
+
+# Report the cost of unattached volumes by team, pricing gp2 at a discounted rate
+- ec2_vol:
+    state: report
+    owner_tag: Team
+    prices:
+      gp2: 0.09
+      io1:
+        gib_month: 0.11
+        iops_month: 0.06
+  register: orphans
+
 # Create new volume using SSD storage
 - ec2_vol:
     instance: XXXXXX
     volume_size: 50
     volume_type: gp2
     device_name: /dev/xvdf
+
+# Create the cheapest volume that gives at least 5000 IOPS and 250MB/s and 500GB
+- ec2_vol:
+    instance: XXXXXX
+    performance:
+      iops: 5000
+      throughput: 250
+      min_size: 500
+  register: ec2_vol
+
+# Attach four 500GB gp3 volumes to stripe together
+- ec2_vol:
+    instance: XXXXXX
+    stripe_set:
+      name: db-data
+      count: 4
+      volume_size: 500
+      volume_type: gp3
+      devices: ['/dev/xvdf', '/dev/xvdg', '/dev/xvdh', '/dev/xvdi']
+  register: ec2_vol
+
+# Grow an existing volume to 200GB and move it to gp2
+- ec2_vol:
+    id: vol-XXXXXXXX
+    volume_size: 200
+    volume_type: gp2
+    modify: yes
+
+# Create and attach volumes to several instances in one task. Options set at the
+# top level (volume_type here) apply to every item that does not override them.
+- ec2_vol:
+    volume_type: gp2
+    concurrency: 20
+    volumes:
+      - instance: i-XXXXXX
+        name: data
+        volume_size: 100
+        device_name: /dev/xvdf
+      - instance: i-YYYYYY
+        name: logs
+        volume_size: 20
+        device_name: /dev/xvdg
+
+# Give every instance of a group a 100GB data volume on /dev/xvdf
+- ec2_vol:
+    instances: "{{ ec2.instance_ids }}"
+    name: data
+    volume_size: 100
+    volume_type: gp2
+    device_name: /dev/xvdf
+
+# Report how long each EC2 API call took
+- ec2_vol:
+    instance: XXXXXX
+    volume_size: 5
+    instrumentation: yes
+  register: ec2_vol
+- debug: var=ec2_vol.metrics
 '''
 
+import datetime
+import hashlib
+import json
+import math
+import random
+import threading
 import time
 
-from distutils.version import LooseVersion
+from multiprocessing.pool import ThreadPool
 
 try:
-    import boto.ec2
-    from boto.exception import BotoServerError
-    HAS_BOTO = True
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import BotoCoreError, ClientError
+    HAS_BOTO3 = True
 except ImportError:
-    HAS_BOTO = False
+    HAS_BOTO3 = False
 
+# Keys accepted in each item of the volumes option
+VOLUME_SPEC_KEYS = ['instance', 'id', 'name', 'volume_size', 'volume_type', 'iops', 'encrypted',
+                    'device_name', 'zone', 'snapshot', 'modify', 'throughput', 'performance', 'client_token']
 
-def get_volume(module, ec2):
-    name = module.params.get('name')
-    id = module.params.get('id')
-    zone = module.params.get('zone')
-    filters = {}
-    volume_ids = None
+# Keys of the dicts returned by get_volume_info, which may be selected with the fields option
+VOLUME_INFO_FIELDS = ['create_time', 'id', 'iops', 'throughput', 'size', 'snapshot_id', 'status', 'type',
+                      'zone', 'attachment_set', 'tags']
 
-    # If no name or id supplied, just try volume creation based on module parameters
-    if id is None and name is None:
-        return None
+# Tags identifying the members of a stripe_set
+STRIPE_SET_TAG = 'StripeSet'
+STRIPE_MEMBER_TAG = 'StripeSetMember'
 
-    if zone:
-        filters['availability_zone'] = zone
-    if name:
-        filters = {'tag:Name': name}
-    if id:
-        volume_ids = [id]
-    try:
-        vols = ec2.get_all_volumes(volume_ids=volume_ids, filters=filters)
-    except boto.exception.BotoServerError, e:
-        module.fail_json(msg = "%s: %s" % (e.error_code, e.error_message))
+# Conditions a volume can be waited on, keyed by the name reported in timeouts and wait_times
+WAIT_CONDITIONS = {
+    'available': lambda volume: volume.status == 'available',
+    'attached': lambda volume: volume.attachment_state() == 'attached',
+    'detached': lambda volume: volume.attachment_state() is None,
+}
 
-    if not vols:
-        if id:
-            msg = "Could not find the volume with id: %s" % id
-            if name:
-                msg += (" and name: %s" % name)
-            module.fail_json(msg=msg)
-        else:
-            return None
 
-    if len(vols) > 1:
-        module.fail_json(msg="Found more than one volume in zone (if specified) with name: %s" % name)
-    return vols[0]
+# Performance limits and us-east-1 monthly prices (USD) of each EBS volume type, used to resolve the
+# performance option. See http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/ebs-volume-types.html
+#   gp2 performance scales with size (iops_per_gib), up to large_throughput from large_throughput_size GiB
+#   gp3 includes baseline_iops and baseline_throughput and more of either can be provisioned
+#   io1/io2 throughput scales with the provisioned IOPS (throughput_per_iops)
+#   st1/sc1 throughput scales with size (throughput_per_tib)
+VOLUME_TYPES = {
+    'standard': dict(min_size=1, max_size=1024, max_iops=200, max_throughput=90, gib_month=0.05),
+    'gp2': dict(min_size=1, max_size=16384, min_iops=100, max_iops=16000, iops_per_gib=3,
+                throughput=128, large_throughput=250, large_throughput_size=334, gib_month=0.10),
+    'gp3': dict(min_size=1, max_size=16384, baseline_iops=3000, max_iops=16000, max_iops_per_gib=500,
+                baseline_throughput=125, max_throughput=1000, max_throughput_per_iops=0.25,
+                gib_month=0.08, iops_month=0.005, throughput_month=0.04),
+    'io1': dict(min_size=4, max_size=16384, min_iops=100, max_iops=64000, max_iops_per_gib=50,
+                throughput_per_iops=0.256, max_throughput=1000, gib_month=0.125, iops_month=0.065),
+    'io2': dict(min_size=4, max_size=16384, min_iops=100, max_iops=64000, max_iops_per_gib=500,
+                throughput_per_iops=0.256, max_throughput=1000, gib_month=0.125, iops_month=0.065),
+    'st1': dict(min_size=125, max_size=16384, max_iops=500, throughput_per_tib=40, max_throughput=500,
+                gib_month=0.045),
+    'sc1': dict(min_size=125, max_size=16384, max_iops=250, throughput_per_tib=12, max_throughput=250,
+                gib_month=0.015),
+}
 
-def get_volumes(module, ec2):
-    
-    instance = module.params.get('instance')
+# The most ids looked up with one instance-id or volume-id filter, and the DescribeInstances page size
+FILTER_CHUNK = 200
+INSTANCE_PAGE_SIZE = 1000
 
-    try:
-        if not instance:
-            vols = ec2.get_all_volumes()
-        else:
-            vols = ec2.get_all_volumes(filters={'attachment.instance-id': instance})
-    except boto.exception.BotoServerError, e:
-        module.fail_json(msg = "%s: %s" % (e.error_code, e.error_message))
-    return vols
+# Upper bounds in days, and names, of the age groups of state=report
+AGE_GROUPS = [(7, '0-7d'), (30, '7-30d'), (90, '30-90d'), (365, '90-365d'), (None, '365d+')]
+
+# Volume types considered by the performance option when its types key is not given, cheapest first
+# when prices are equal. standard is a previous generation type so is only used when asked for.
+PERFORMANCE_VOLUME_TYPES = ['gp3', 'gp2', 'io2', 'io1', 'st1', 'sc1']
+
+
+class VolumeError(Exception):
+    pass
 
-def delete_volume(module, ec2):
-    volume_id = module.params['id']
-    try:
-        ec2.delete_volume(volume_id)
-        module.exit_json(changed=True)
-    except boto.exception.EC2ResponseError as ec2_error:
-        if ec2_error.code == 'InvalidVolume.NotFound':
-            module.exit_json(changed=False)
-        module.fail_json(msg=ec2_error.message)
 
-def boto_supports_volume_encryption():
+class ApiMetrics(object):
+    """
+    Counts and latencies of the API calls made during this run, and the time spent sleeping between polls.
     """
-    Check if Boto library supports encryption of EBS volumes (added in 2.29.0)
 
-    Returns:
-        True if boto library has the named param as an argument on the request_spot_instances method, else False
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latencies = {}
+        self.errors = {}
+        self.retries = {}
+        self.sleeps = 0
+        self.sleep_time = 0.0
+
+    def record_call(self, operation, latency, error=False):
+        with self.lock:
+            self.latencies.setdefault(operation, []).append(latency)
+            if error:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def record_retry(self, operation, count=1):
+        with self.lock:
+            self.retries[operation] = self.retries.get(operation, 0) + count
+
+    def record_sleep(self, seconds):
+        with self.lock:
+            self.sleeps += 1
+            self.sleep_time += seconds
+
+    def summary(self):
+
+        def percentile(ordered, fraction):
+            return round(ordered[max(0, int(math.ceil(fraction * len(ordered))) - 1)], 3)
+
+        operations = {}
+        for operation, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            operations[operation] = {
+                'count': len(ordered),
+                'errors': self.errors.get(operation, 0),
+                'retries': self.retries.get(operation, 0),
+                'total_time': round(sum(ordered), 3),
+                'p50': percentile(ordered, 0.5),
+                'p95': percentile(ordered, 0.95)
+            }
+
+        return {
+            'operations': operations,
+            'api_calls': sum(op['count'] for op in operations.values()),
+            'api_time': round(sum(op['total_time'] for op in operations.values()), 3),
+            'retries': sum(self.retries.values()),
+            'sleeps': self.sleeps,
+            'sleep_time': round(self.sleep_time, 3),
+            'elapsed': round(time.time() - self.started, 3)
+        }
+
+
+class InstrumentedConnection(object):
+    """
+    Wrap a boto3 EC2 client so that every API call made through it is timed and counted in metrics,
+    along with the retries botocore made for it. Everything else is passed through to the client.
     """
-    return hasattr(boto, 'Version') and LooseVersion(boto.Version) >= LooseVersion('2.29.0')
 
-    
-def create_volume(module, ec2, zone):
-    changed = False
-    name = module.params.get('name')
-    id = module.params.get('id')
-    instance = module.params.get('instance')
-    iops = module.params.get('iops')
-    encrypted = module.params.get('encrypted')
-    volume_size = module.params.get('volume_size')
-    volume_type = module.params.get('volume_type')
-    snapshot = module.params.get('snapshot')
-    # If custom iops is defined we use volume_type "io1" rather than the default of "standard"
-    if iops:
-        volume_type = 'io1'
-
-    volume = get_volume(module, ec2)
-    if volume is None:
-        try:
-            if boto_supports_volume_encryption():
-                volume = ec2.create_volume(volume_size, zone, snapshot, volume_type, iops, encrypted)
-                changed = True
-            else:
-                volume = ec2.create_volume(volume_size, zone, snapshot, volume_type, iops)
-                changed = True
+    def __init__(self, connection, metrics):
+        self.connection = connection
+        self.metrics = metrics
 
-            while volume.status != 'available':
-                time.sleep(3)
-                volume.update()
+    def __getattr__(self, name):
+        attr = getattr(self.connection, name)
+        operation = self.connection.meta.method_to_api_mapping.get(name)
+        if operation is None:
+            return attr
 
-            if name:
-                ec2.create_tags([volume.id], {"Name": name})
-        except boto.exception.BotoServerError, e:
-            module.fail_json(msg = "%s: %s" % (e.error_code, e.error_message))
+        def call(*args, **kwargs):
+            start = time.time()
+            try:
+                response = attr(*args, **kwargs)
+            except ClientError as e:
+                self.metrics.record_call(operation, time.time() - start, error=True)
+                self.record_retries(operation, e.response)
+                raise
+            except Exception:
+                self.metrics.record_call(operation, time.time() - start, error=True)
+                raise
+            self.metrics.record_call(operation, time.time() - start)
+            self.record_retries(operation, response)
+            return response
 
-    return volume, changed
+        return call
 
+    def record_retries(self, operation, response):
+        retries = response.get('ResponseMetadata', {}).get('RetryAttempts')
+        if retries:
+            self.metrics.record_retry(operation, retries)
 
-def attach_volume(module, ec2, volume, instance):
-    
-    device_name = module.params.get('device_name')
-    changed = False
-    
-    # If device_name isn't set, make a choice based on best practices here:
-    # http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/block-device-mapping-concepts.html
-    
-    # In future this needs to be more dynamic but combining block device mapping best practices
-    # (bounds for devices, as above) with instance.block_device_mapping data would be tricky. For me ;)
-    
-    # Use password data attribute to tell whether the instance is Windows or Linux
-    if device_name is None:
-        try:
-            if not ec2.get_password_data(instance.id):
-                device_name = '/dev/sdf'
-            else:
-                device_name = '/dev/xvdf'
-        except boto.exception.BotoServerError, e:
-            module.fail_json(msg = "%s: %s" % (e.error_code, e.error_message))
-    
-    if volume.attachment_state() is not None:
-        adata = volume.attach_data
-        if adata.instance_id != instance.id:
-            module.fail_json(msg = "Volume %s is already attached to another instance: %s"
-                             % (volume.id, adata.instance_id))
-    else:
-        try:
-            volume.attach(instance.id, device_name)
-            while volume.attachment_state() != 'attached':
-                time.sleep(3)
-                volume.update()
-            changed = True
-        except boto.exception.BotoServerError, e:
-            module.fail_json(msg = "%s: %s" % (e.error_code, e.error_message))
 
-    return volume, changed
+def sleep(ec2, seconds):
+    """
+    Sleep, recording the time in the connection's metrics if it is instrumented.
+    """
+    metrics = getattr(ec2, 'metrics', None)
+    if metrics is not None:
+        metrics.record_sleep(seconds)
+    time.sleep(seconds)
 
-def detach_volume(module, ec2, volume):
-    
-    changed = False
-    
-    if volume.attachment_state() is not None:
-        adata = volume.attach_data
-        volume.detach()
-        while volume.attachment_state() is not None:
-            time.sleep(3)
-            volume.update()
-        changed = True
-        
-    return volume, changed
-        
-def get_volume_info(volume, state):
-    
-    # If we're just listing volumes then do nothing, else get the latest update for the volume
-    if state != 'list':
-        volume.update()
-    
-    volume_info = {}
-    attachment = volume.attach_data
 
-    volume_info = {
-                    'create_time': volume.create_time,
-                    'id': volume.id,
-                    'iops': volume.iops,
-                    'size': volume.size,
-                    'snapshot_id': volume.snapshot_id,
-                    'status': volume.status,
-                    'type': volume.type,
-                    'zone': volume.zone,
-                    'attachment_set': {
-                        'attach_time': attachment.attach_time,
-                        'device': attachment.device,
-                        'instance_id': attachment.instance_id,
-                        'status': attachment.status
-                    },
-                    'tags': volume.tags
-                }
-    
-    return volume_info
+def record_retry(ec2, operation):
+    metrics = getattr(ec2, 'metrics', None)
+    if metrics is not None:
+        metrics.record_retry(operation)
 
-def main():
-    argument_spec = ec2_argument_spec()
-    argument_spec.update(dict(
-            instance = dict(),
-            id = dict(),
-            name = dict(),
-            volume_size = dict(),
-            volume_type = dict(choices=['standard', 'gp2', 'io1'], default='standard'),
-            iops = dict(),
-            encrypted = dict(),
-            device_name = dict(),
-            zone = dict(aliases=['availability_zone', 'aws_zone', 'ec2_zone']),
-            snapshot = dict(),
-            state = dict(choices=['absent', 'present', 'list'], default='present')
-        )
-    )
-    module = AnsibleModule(argument_spec=argument_spec)
 
-    if not HAS_BOTO:
-        module.fail_json(msg='boto required for this module')
+class DeviceAllocator(object):
+    """
+    Hand out free device names on instances, following the naming recommendations at
+    http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/device_naming.html
 
-    id = module.params.get('id')
-    name = module.params.get('name')
-    instance = module.params.get('instance')
-    volume_size = module.params.get('volume_size')
-    volume_type = module.params.get('volume_type')
-    iops = module.params.get('iops')
-    encrypted = module.params.get('encrypted')
-    device_name = module.params.get('device_name')
-    zone = module.params.get('zone')
-    snapshot = module.params.get('snapshot')
-    state = module.params.get('state')
-    
-    # Ensure we have the zone or can get the zone
-    if id is None and zone is None and state == 'present':
-        module.fail_json(msg="You must specify either instance or zone")
-    
-    # Set volume detach flag
-    if instance == 'None' or instance == '':
-        instance = None
-        detach_vol_flag = True
-    else:
-        detach_vol_flag = False
-        
-    # Set changed flag
-    changed = False
+    The devices in use on an instance are read from its block_device_mapping, so no API calls are
+    needed, and names handed out or reserved during this run are remembered so that several
+    volumes can be attached to the same instance at once.
+    """
 
-    region, ec2_url, aws_connect_params = get_aws_connection_info(module)
-    
-    if region:
-        try:
-            ec2 = connect_to_aws(boto.ec2, region, **aws_connect_params)
-        except (boto.exception.NoAuthHandlerFound, StandardError), e:
-            module.fail_json(msg=str(e))
-    else:
-        module.fail_json(msg="region must be specified")
+    LINUX_DEVICES = ('/dev/sd', 'fghijklmnop')
+    WINDOWS_DEVICES = ('/dev/xvd', 'fghijklmnopqrstuvwxyz')
 
-    if state == 'list':
-        returned_volumes = []
-        vols = get_volumes(module, ec2)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.used = {}
 
-        for v in vols:
-            attachment = v.attach_data
+    @staticmethod
+    def device_letter(device_name):
+        # /dev/sdf, /dev/xvdf and xvdf all refer to the same device slot
+        name = device_name.split('/')[-1]
+        for prefix in ('xvd', 'sd', 'hd'):
+            if name.startswith(prefix):
+                return name[len(prefix):len(prefix) + 1]
+        return name
 
-            returned_volumes.append(get_volume_info(v, state))
+    def _used(self, instance):
+        if instance.id not in self.used:
+            self.used[instance.id] = set(self.device_letter(d) for d in instance.block_device_mapping)
+        return self.used[instance.id]
 
-        module.exit_json(changed=False, volumes=returned_volumes)
+    def reserve(self, instance, device_name):
+        with self.lock:
+            self._used(instance).add(self.device_letter(device_name))
 
-    if encrypted and not boto_supports_volume_encryption():
-        module.fail_json(msg="You must use boto >= v2.29.0 to use encrypted volumes")
+    def allocate(self, instance):
+        if getattr(instance, 'platform', None) == 'windows':
+            prefix, letters = self.WINDOWS_DEVICES
+        else:
+            prefix, letters = self.LINUX_DEVICES
 
-    # Here we need to get the zone info for the instance. This covers situation where
-    # instance is specified but zone isn't.
-    # Useful for playbooks chaining instance launch with volume create + attach and where the
-    # zone doesn't matter to the user.
-    inst = None
-    if instance:
-        try:
-            reservation = ec2.get_all_instances(instance_ids=instance)
-        except BotoServerError as e:
-            module.fail_json(msg=e.message)
-        inst = reservation[0].instances[0]
-        zone = inst.placement
+        with self.lock:
+            used = self._used(instance)
+            for letter in letters:
+                if letter not in used:
+                    used.add(letter)
+                    return prefix + letter
 
-        # Check if there is a volume already mounted there.
-        if device_name:
-            if device_name in inst.block_device_mapping:
-                module.exit_json(msg="Volume mapping for %s already exists on instance %s" % (device_name, instance),
-                                 volume_id=inst.block_device_mapping[device_name].volume_id,
-                                 device=device_name,
-                                 changed=False)
+        raise VolumeError("No free device names left on instance %s" % instance.id)
 
-    # Delaying the checks until after the instance check allows us to get volume ids for existing volumes
-    # without needing to pass an unused volume_size
-    if not volume_size and not (id or name or snapshot):
-        module.fail_json(msg="You must specify volume_size or identify an existing volume by id, name, or snapshot")
 
-    if volume_size and (id or snapshot):
-        module.fail_json(msg="Cannot specify volume_size together with id or snapshot")
-    
-    if state == 'present':
-        volume, changed = create_volume(module, ec2, zone)
-        if detach_vol_flag:
-            volume, changed = detach_volume(module, ec2, volume)    
-        elif inst is not None:
-            volume, changed = attach_volume(module, ec2, volume, inst)
+class VolumeCache(object):
+    """
+    The last known state of every volume touched during this run, keyed by volume id.
 
-        module.exit_json(changed=changed, volume=get_volume_info(volume, state))
-    elif state == 'absent':
-        delete_volume(module, ec2)
+    Volumes are stored from whichever API response last described them, so results can be built
+    without describing each volume again. Volumes changed since they were last described are
+    marked stale and refreshed together with a single DescribeVolumes call.
+    """
 
-# import module snippets
-from ansible.module_utils.basic import *
-from ansible.module_utils.ec2 import *
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.volumes = {}
+        self.stale = set()
 
-main()
+    def store(self, volume, stale=False):
+        with self.lock:
+            self.volumes[volume.id] = volume
+            if stale:
+                self.stale.add(volume.id)
+            else:
+                self.stale.discard(volume.id)
+
+    def invalidate(self, volume_id):
+        with self.lock:
+            self.stale.add(volume_id)
+
+    def get(self, volume_id):
+        return self.volumes[volume_id]
+
+    def refresh(self, ec2):
+        if self.stale:
+            for volume in describe_volumes(ec2, list(self.stale)):
+                self.store(volume)
+
+
+class RateLimiter(object):
+    """
+    Space out calls made from any number of threads to at most rate per second. A rate of None
+    or 0 does not limit.
+    """
 
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_call = 0
+
+    def wait(self, ec2):
+        with self.lock:
+            now = time.time()
+            delay = max(0, self.next_call - now)
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay:
+            sleep(ec2, delay)
+
+
+class InstanceIndex(object):
+    """
+    Instances by id, so that their zone, platform and mapped devices are looked up once per run.
+
+    Instances are described in chunks of FILTER_CHUNK ids with an instance-id filter rather
+    than by id, so that the results can be paginated and an unknown id does not fail the whole lookup.
+    """
+
+    def __init__(self):
+        self.instances = {}
+
+    def load(self, ec2, instance_ids):
+        """
+        Describe every instance in instance_ids that is not already in the index.
+        """
+        missing = sorted(set(instance_ids) - set(self.instances))
+        for start in range(0, len(missing), FILTER_CHUNK):
+            kwargs = dict(Filters=make_filter_list({'instance-id': missing[start:start + FILTER_CHUNK]}),
+                          MaxResults=INSTANCE_PAGE_SIZE)
+            while True:
+                response = ec2.describe_instances(**kwargs)
+                for reservation in response['Reservations']:
+                    for instance in reservation['Instances']:
+                        inst = Instance(instance)
+                        self.instances[inst.id] = inst
+                if not response.get('NextToken'):
+                    break
+                kwargs['NextToken'] = response['NextToken']
+
+    def get(self, instance_id):
+        inst = self.instances.get(instance_id)
+        if inst is None:
+            raise VolumeError("Instance %s not found" % instance_id)
+        return inst
+
+
+class VolumeWaiter(object):
+    """
+    Wait for a set of volumes to reach a condition.
+
+    All pending volumes are checked with a single DescribeVolumes call per poll. The delay before
+    each poll backs off exponentially, with jitter, up to max_delay. Every volume described while
+    polling is stored in cache.
+    """
+
+    def __init__(self, ec2, cache, wait_timeout, delay=2, max_delay=30):
+        self.ec2 = ec2
+        self.cache = cache
+        self.wait_timeout = wait_timeout
+        self.delay = delay
+        self.max_delay = max_delay
+        self.pending = {}
+        self.started = {}
+
+    def add(self, volume_id, condition):
+        self.pending[volume_id] = condition
+        self.started[volume_id] = time.time()
+
+    def poll(self):
+        """
+        Describe every pending volume.
+
+        Returns:
+            A dict mapping volume id to the described volume
+        """
+        try:
+            volumes = describe_volumes(self.ec2, list(self.pending))
+        except ClientError as e:
+            # A volume that was only just created may not be visible to DescribeVolumes yet
+            if get_error_code(e) == 'InvalidVolume.NotFound':
+                record_retry(self.ec2, 'DescribeVolumes')
+                return {}
+            raise
+
+        for volume in volumes:
+            self.cache.store(volume)
+        return dict((volume.id, volume) for volume in volumes)
+
+    def check(self, volume, condition):
+        """
+        Returns True once volume has reached condition. Raises VolumeError if it never will.
+        """
+        if volume.status == 'error':
+            raise VolumeError("Volume %s is in the error state" % volume.id)
+        return WAIT_CONDITIONS[condition](volume)
+
+    def wait(self):
+        """
+        Poll until every pending volume has reached its condition, failed or timed out.
+
+        Returns:
+            A tuple of (wait_times, failures). wait_times maps the id of each volume that reached its
+            condition to the number of seconds waited and failures maps the id of any other volume to an
+            error message. The last described state of each volume is in cache.
+        """
+        deadline = time.time() + self.wait_timeout
+        wait_times = {}
+        failures = {}
+        attempt = 0
+
+        while self.pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                for volume_id, condition in self.pending.items():
+                    failures[volume_id] = "Timed out waiting for volume %s to become %s" % (volume_id, condition)
+                self.pending = {}
+                break
+
+            # Volumes are never ready straight after a change so sleep before the first poll too
+            delay = min(self.max_delay, self.delay * 2 ** attempt)
+            sleep(self.ec2, min(remaining, delay / 2.0 + random.uniform(0, delay / 2.0)))
+            attempt += 1
+
+            for volume_id, described in self.poll().items():
+                condition = self.pending.get(volume_id)
+                if condition is None:
+                    continue
+                try:
+                    if not self.check(described, condition):
+                        continue
+                    wait_times[volume_id] = round(time.time() - self.started[volume_id], 1)
+                except VolumeError as e:
+                    failures[volume_id] = str(e)
+                del self.pending[volume_id]
+
+        return wait_times, failures
+
+
+class ModificationWaiter(VolumeWaiter):
+    """
+    Wait for a set of volume modifications to reach the optimizing or completed state, checking all
+    of them with a single DescribeVolumesModifications call per poll.
+
+    The last described modification of each volume is kept in modifications.
+    """
+
+    def __init__(self, ec2, cache, wait_timeout, **kwargs):
+        super(ModificationWaiter, self).__init__(ec2, cache, wait_timeout, **kwargs)
+        self.modifications = {}
+
+    def poll(self):
+        for modification in describe_volume_modifications(self.ec2, list(self.pending)):
+            self.modifications[modification.volume_id] = modification
+        return dict((volume_id, self.modifications[volume_id]) for volume_id in self.pending
+                    if volume_id in self.modifications)
+
+    def check(self, modification, condition):
+        state = modification.modification_state
+        if state == 'failed':
+            raise VolumeError("Modification of volume %s failed: %s" % (modification.volume_id, modification.status_message))
+        if condition == 'optimizing':
+            return state in ('optimizing', 'completed')
+        return state == 'completed'
+
+
+class VolumeAttachment(object):
+    """
+    The first attachment of a volume from a boto3 response, with every attribute None if it has none.
+    """
+
+    def __init__(self, attachment=None):
+        attachment = attachment or {}
+        self.instance_id = attachment.get('InstanceId')
+        self.device = attachment.get('Device')
+        self.status = attachment.get('State')
+        self.attach_time = format_time(attachment.get('AttachTime'))
+
+
+class Volume(object):
+    """
+    A volume from a boto3 DescribeVolumes or CreateVolume response, with the attributes of a boto
+    Volume so that results keep their format.
+    """
+
+    def __init__(self, volume):
+        self.id = volume['VolumeId']
+        self.size = volume.get('Size')
+        self.type = volume.get('VolumeType')
+        self.iops = volume.get('Iops')
+        self.throughput = volume.get('Throughput')
+        self.snapshot_id = volume.get('SnapshotId')
+        self.status = volume.get('State')
+        self.create_time = format_time(volume.get('CreateTime'))
+        self.zone = volume.get('AvailabilityZone')
+        self.encrypted = volume.get('Encrypted')
+        self.tags = dict((tag['Key'], tag['Value']) for tag in volume.get('Tags') or [])
+        attachments = volume.get('Attachments') or [None]
+        self.attach_data = VolumeAttachment(attachments[0])
+
+    def attachment_state(self):
+        return self.attach_data.status
+
+
+class BlockDevice(object):
+
+    def __init__(self, mapping):
+        self.volume_id = mapping.get('Ebs', {}).get('VolumeId')
+
+
+class Instance(object):
+    """
+    An instance from a boto3 DescribeInstances response, with the attributes of a boto Instance that
+    are used to place and name volumes.
+    """
+
+    def __init__(self, instance):
+        self.id = instance['InstanceId']
+        self.placement = instance['Placement']['AvailabilityZone']
+        self.platform = instance.get('Platform')
+        self.block_device_mapping = dict((mapping['DeviceName'], BlockDevice(mapping))
+                                         for mapping in instance.get('BlockDeviceMappings') or [])
+
+
+class VolumeModification(object):
+    """
+    A volume modification from a ModifyVolume or DescribeVolumesModifications response.
+    """
+
+    FIELDS = {
+        'VolumeId': 'volume_id',
+        'ModificationState': 'modification_state',
+        'StatusMessage': 'status_message',
+        'TargetSize': 'target_size',
+        'TargetIops': 'target_iops',
+        'TargetVolumeType': 'target_volume_type',
+        'OriginalSize': 'original_size',
+        'OriginalIops': 'original_iops',
+        'OriginalVolumeType': 'original_volume_type',
+        'Progress': 'progress',
+        'StartTime': 'start_time',
+        'EndTime': 'end_time',
+    }
+
+    def __init__(self, modification):
+        for key, attr in self.FIELDS.items():
+            value = modification.get(key)
+            if key.endswith('Time'):
+                value = format_time(value)
+            setattr(self, attr, value)
+
+
+def format_time(value):
+    """
+    Format a datetime from a boto3 response the way EC2 and boto do, e.g. 2016-01-01T00:00:00.000Z
+    """
+    if value is None:
+        return None
+    return value.strftime('%Y-%m-%dT%H:%M:%S') + '.%03dZ' % (value.microsecond // 1000)
+
+def make_filter_list(filters_dict):
+
+    filter_list = []
+
+    for k, v in filters_dict.items():
+        filter_dict = {'Name': k}
+        if isinstance(v, basestring):
+            filter_dict['Values'] = [v]
+        else:
+            filter_dict['Values'] = v
+
+        filter_list.append(filter_dict)
+
+    return filter_list
+
+def get_error_code(e):
+    return e.response.get('Error', {}).get('Code')
+
+def get_error_message(e):
+    """
+    Returns:
+        The error code and message of a ClientError, or the message of any other botocore error
+    """
+    if isinstance(e, ClientError):
+        return "%s: %s" % (get_error_code(e), e.response.get('Error', {}).get('Message'))
+    return str(e)
+
+def describe_volumes(ec2, volume_ids=None, filters=None):
+    kwargs = {}
+    if volume_ids:
+        kwargs['VolumeIds'] = volume_ids
+    if filters:
+        kwargs['Filters'] = make_filter_list(filters)
+    return [Volume(volume) for volume in ec2.describe_volumes(**kwargs)['Volumes']]
+
+def modify_volume(ec2, volume_id, changes):
+    response = ec2.modify_volume(VolumeId=volume_id, **changes)
+    return VolumeModification(response['VolumeModification'])
+
+def describe_volume_modifications(ec2, volume_ids):
+    response = ec2.describe_volumes_modifications(VolumeIds=volume_ids)
+    return [VolumeModification(modification) for modification in response['VolumesModifications']]
+
+def get_volume_changes(volume, params):
+    """
+    Compare an existing volume with params.
+
+    Returns:
+        A dict of the ModifyVolume arguments needed to make the volume match params, empty if it already does
+    """
+    volume_size = params.get('volume_size')
+    volume_type = params.get('volume_type')
+    iops = params.get('iops')
+    changes = {}
+
+    if volume_size and int(volume_size) != int(volume.size):
+        if int(volume_size) < int(volume.size):
+            raise VolumeError("Cannot shrink volume %s from %s to %s GiB" % (volume.id, volume.size, volume_size))
+        changes['Size'] = int(volume_size)
+    if volume_type and volume_type != volume.type:
+        changes['VolumeType'] = volume_type
+    if iops and int(iops) != int(volume.iops or 0):
+        changes['Iops'] = int(iops)
+    # Only gp3 volumes report their throughput
+    throughput = params.get('throughput')
+    current_throughput = getattr(volume, 'throughput', None)
+    if throughput and current_throughput is not None and int(throughput) != int(current_throughput):
+        changes['Throughput'] = int(throughput)
+
+    return changes
+
+def get_modification_info(modification):
+
+    def to_int(value):
+        if value is None:
+            return None
+        return int(value)
+
+    modification_info = {
+                    'state': modification.modification_state,
+                    'status_message': modification.status_message,
+                    'progress': to_int(modification.progress),
+                    'start_time': modification.start_time,
+                    'end_time': modification.end_time,
+                    'original': {
+                        'size': to_int(modification.original_size),
+                        'iops': to_int(modification.original_iops),
+                        'type': modification.original_volume_type
+                    },
+                    'target': {
+                        'size': to_int(modification.target_size),
+                        'iops': to_int(modification.target_iops),
+                        'type': modification.target_volume_type
+                    }
+                }
+
+    return modification_info
+
+
+def get_volume(ec2, params, instance=None):
+    """
+    Find the volume identified by the id or name of params. Given instance, only a volume attached to it
+    is found.
+    """
+    name = params.get('name')
+    id = params.get('id')
+    zone = params.get('zone')
+    filters = {}
+    volume_ids = None
+
+    # If no name or id supplied, just try volume creation based on module parameters
+    if id is None and name is None:
+        return None
+
+    if instance is not None:
+        zone = instance.placement
+        filters['attachment.instance-id'] = instance.id
+    if zone:
+        filters['availability-zone'] = zone
+    if name:
+        filters['tag:Name'] = name
+    if id:
+        volume_ids = [id]
+    vols = describe_volumes(ec2, volume_ids, filters)
+
+    if not vols:
+        if id:
+            msg = "Could not find the volume with id: %s" % id
+            if name:
+                msg += (" and name: %s" % name)
+            raise VolumeError(msg)
+        else:
+            return None
+
+    if len(vols) > 1:
+        raise VolumeError("Found more than one volume in zone (if specified) with name: %s" % name)
+    return vols[0]
+
+def iter_volume_pages(ec2, filters, page_size):
+    """
+    Yield pages of volumes from DescribeVolumes, following NextToken until there are no more pages.
+    """
+    kwargs = {}
+    if filters:
+        kwargs['Filters'] = make_filter_list(filters)
+    if page_size:
+        kwargs['MaxResults'] = page_size
+
+    while True:
+        response = ec2.describe_volumes(**kwargs)
+        yield [Volume(volume) for volume in response['Volumes']]
+        if not response.get('NextToken'):
+            break
+        kwargs['NextToken'] = response['NextToken']
+
+def list_volumes(module, ec2):
+    """
+    Stream volumes matching the list options into a list of volume info dicts.
+
+    Each page is converted and projected onto fields as it arrives so volumes are never
+    held for more than one page, and no further pages are requested once limit is reached.
+    """
+    instance = module.params.get('instance')
+    zone = module.params.get('zone')
+    fields = module.params.get('fields')
+    limit = module.params.get('limit')
+
+    filters = dict(module.params.get('filters') or {})
+    if instance:
+        filters['attachment.instance-id'] = instance
+    if zone:
+        filters['availability-zone'] = zone
+
+    if fields:
+        unknown = set(fields) - set(VOLUME_INFO_FIELDS)
+        if unknown:
+            module.fail_json(msg="Unsupported fields: %s. Choose from %s"
+                                 % (', '.join(sorted(unknown)), ', '.join(VOLUME_INFO_FIELDS)))
+
+    volumes = []
+    truncated = False
+    try:
+        for page in iter_volume_pages(ec2, filters, module.params.get('page_size')):
+            for volume in page:
+                volume_info = get_volume_info(volume)
+                if fields:
+                    volume_info = dict((k, volume_info[k]) for k in fields)
+                volumes.append(volume_info)
+                if limit and len(volumes) >= limit:
+                    truncated = True
+                    break
+            if truncated:
+                break
+    except (BotoCoreError, ClientError) as e:
+        module.fail_json(msg=get_error_message(e))
+
+    return volumes, truncated
+
+def get_price_table(prices):
+    """
+    Merge the prices option over the prices in VOLUME_TYPES. A price may be given as a number, the
+    price per GiB-month, or as a dict of gib_month, iops_month and throughput_month.
+    """
+    table = {}
+    for volume_type, limits in VOLUME_TYPES.items():
+        table[volume_type] = dict((k, v) for k, v in limits.items() if k.endswith('_month'))
+    for volume_type, price in (prices or {}).items():
+        if isinstance(price, dict):
+            unknown = set(price.keys()) - set(['gib_month', 'iops_month', 'throughput_month'])
+            if unknown:
+                raise VolumeError("Unsupported prices for %s: %s" % (volume_type, ', '.join(sorted(unknown))))
+            table.setdefault(volume_type, {}).update((k, float(v)) for k, v in price.items())
+        else:
+            table.setdefault(volume_type, {})['gib_month'] = float(price)
+    return table
+
+def get_monthly_cost(volume, price_table):
+    """
+    Returns:
+        The estimated monthly cost of volume, or None if there is no price for its type
+    """
+    prices = price_table.get(volume.type)
+    if not prices or 'gib_month' not in prices:
+        return None
+    limits = VOLUME_TYPES.get(volume.type, {})
+    cost = int(volume.size) * prices['gib_month']
+    if prices.get('iops_month') and volume.iops:
+        cost += max(0, int(volume.iops) - limits.get('baseline_iops', 0)) * prices['iops_month']
+    throughput = getattr(volume, 'throughput', None)
+    if prices.get('throughput_month') and throughput:
+        cost += max(0, int(throughput) - limits.get('baseline_throughput', 0)) * prices['throughput_month']
+    return cost
+
+def get_age_group(create_time, now):
+    created = datetime.datetime.strptime(create_time[:19], '%Y-%m-%dT%H:%M:%S')
+    age = (now - created).days
+    for days, name in AGE_GROUPS:
+        if days is None or age < days:
+            return name
+
+def report_volumes(module, ec2):
+    """
+    Summarise the unattached volumes matching the list options by type, zone, age and owner tag, with
+    their estimated monthly cost.
+
+    Volumes are selected with a status=available filter on the server and folded into the summary one
+    page at a time, so only the totals are ever held.
+    """
+    zone = module.params.get('zone')
+    owner_tag = module.params.get('owner_tag')
+
+    filters = dict(module.params.get('filters') or {})
+    filters['status'] = 'available'
+    if zone:
+        filters['availability-zone'] = zone
+
+    try:
+        price_table = get_price_table(module.params.get('prices'))
+    except (VolumeError, TypeError, ValueError) as e:
+        module.fail_json(msg="Invalid prices: %s" % e)
+
+    groups = dict(by_type={}, by_zone={}, by_age={}, by_owner={})
+    totals = dict(count=0, size=0, monthly_cost=0.0, unpriced=0)
+    now = datetime.datetime.utcnow()
+
+    def add(group, size, cost):
+        group['count'] = group.get('count', 0) + 1
+        group['size'] = group.get('size', 0) + size
+        group['monthly_cost'] = group.get('monthly_cost', 0.0) + (cost or 0.0)
+
+    try:
+        for page in iter_volume_pages(ec2, filters, module.params.get('page_size')):
+            for volume in page:
+                size = int(volume.size)
+                cost = get_monthly_cost(volume, price_table)
+                if cost is None:
+                    totals['unpriced'] += 1
+                add(totals, size, cost)
+                add(groups['by_type'].setdefault(volume.type, {}), size, cost)
+                add(groups['by_zone'].setdefault(volume.zone, {}), size, cost)
+                add(groups['by_age'].setdefault(get_age_group(volume.create_time, now), {}), size, cost)
+                add(groups['by_owner'].setdefault(volume.tags.get(owner_tag, 'untagged'), {}), size, cost)
+    except (BotoCoreError, ClientError) as e:
+        module.fail_json(msg=get_error_message(e))
+
+    totals['monthly_cost'] = round(totals['monthly_cost'], 2)
+    for group in groups.values():
+        for summary in group.values():
+            summary['monthly_cost'] = round(summary['monthly_cost'], 2)
+    totals.update(groups)
+    return totals
+
+def delete_volume(ec2, volume_id):
+    """
+    Returns:
+        True if the volume was deleted, False if it did not exist
+    """
+    try:
+        ec2.delete_volume(VolumeId=volume_id)
+    except ClientError as e:
+        if get_error_code(e) == 'InvalidVolume.NotFound':
+            return False
+        raise
+    return True
+
+def find_volumes(ec2, volume_ids, filters, page_size):
+    """
+    Describe the volumes selected by volume_ids or, if not given, by filters.
+
+    volume_ids are looked up in chunks with a volume-id filter so that ids which no longer exist are
+    left out instead of failing the call.
+
+    Returns:
+        A tuple of (volumes, missing) where missing lists the volume_ids that were not found
+    """
+    volumes = {}
+    if volume_ids:
+        for start in range(0, len(volume_ids), FILTER_CHUNK):
+            for page in iter_volume_pages(ec2, {'volume-id': volume_ids[start:start + FILTER_CHUNK]}, page_size):
+                for volume in page:
+                    volumes[volume.id] = volume
+        missing = sorted(set(volume_ids) - set(volumes))
+    else:
+        for page in iter_volume_pages(ec2, filters, page_size):
+            for volume in page:
+                volumes[volume.id] = volume
+        missing = []
+
+    return [volumes[volume_id] for volume_id in sorted(volumes)], missing
+
+def delete_volumes(ec2, volumes, force, concurrency, rate, wait_timeout):
+    """
+    Delete volumes, detaching any that are attached first.
+
+    All detachments are issued before they are waited on together. Deletes are then issued
+    concurrently, at most rate per second across all workers.
+
+    Returns:
+        A dict of changed, the ids of the volumes that were deleted or already absent and the id and
+        error of each failure
+    """
+    cache = VolumeCache()
+    absent = []
+    tasks = []
+    for volume in volumes:
+        if volume.status in ('deleting', 'deleted'):
+            absent.append(volume.id)
+            continue
+        cache.store(volume)
+        tasks.append(dict(volume_id=volume.id, changed=False, wait_times={}))
+
+    def active():
+        return [task for task in tasks if 'result' not in task]
+
+    def detach(conn, task):
+        if detach_volume(conn, cache.get(task['volume_id']), cache, force):
+            task['changed'] = True
+            task['wait_for'] = 'detached'
+
+    limiter = RateLimiter(rate)
+
+    def delete(conn, task):
+        limiter.wait(conn)
+        task['deleted'] = delete_volume(conn, task['volume_id'])
+
+    run_volume_tasks(ec2, active(), detach, concurrency)
+    wait_for_volumes(ec2, active(), cache, wait_timeout)
+    run_volume_tasks(ec2, active(), delete, concurrency)
+
+    deleted = []
+    failures = []
+    for task in tasks:
+        if 'result' in task:
+            failures.append(dict(id=task['volume_id'], msg=task['result']['msg']))
+        elif task['deleted']:
+            deleted.append(task['volume_id'])
+        else:
+            absent.append(task['volume_id'])
+
+    return dict(changed=bool(deleted) or any(task['changed'] for task in tasks),
+                deleted=deleted, absent=sorted(absent), failures=failures)
+
+def size_volume_type(volume_type, target_iops, target_throughput, min_size):
+    """
+    Work out the cheapest configuration of volume_type that meets the performance targets.
+
+    Returns:
+        A dict of the volume_type, volume_size, iops and throughput to create the volume with, the
+        delivered iops and throughput and the monthly_cost, or None if volume_type cannot meet the targets
+    """
+    limits = VOLUME_TYPES[volume_type]
+    size = max(min_size, limits['min_size'])
+    iops = None
+    throughput = None
+
+    def at_least(value):
+        return int(math.ceil(value))
+
+    if volume_type == 'gp3':
+        iops = max(limits['baseline_iops'], target_iops,
+                   at_least(target_throughput / limits['max_throughput_per_iops']))
+        throughput = max(limits['baseline_throughput'], at_least(target_throughput))
+        # The baseline IOPS come with any size; only IOPS above them are limited per GiB
+        if iops > limits['baseline_iops']:
+            size = max(size, at_least(float(iops) / limits['max_iops_per_gib']))
+        delivered_iops, delivered_throughput = iops, throughput
+        cost = (size * limits['gib_month'] + (iops - limits['baseline_iops']) * limits['iops_month'] +
+                (throughput - limits['baseline_throughput']) * limits['throughput_month'])
+    elif volume_type in ('io1', 'io2'):
+        iops = max(limits['min_iops'], target_iops, at_least(target_throughput / limits['throughput_per_iops']))
+        size = max(size, at_least(float(iops) / limits['max_iops_per_gib']))
+        delivered_iops = iops
+        delivered_throughput = min(limits['max_throughput'], iops * limits['throughput_per_iops'])
+        cost = size * limits['gib_month'] + iops * limits['iops_month']
+    elif volume_type == 'gp2':
+        size = max(size, at_least(float(target_iops) / limits['iops_per_gib']))
+        if target_throughput > limits['throughput']:
+            size = max(size, limits['large_throughput_size'])
+        delivered_iops = min(limits['max_iops'], max(limits['min_iops'], size * limits['iops_per_gib']))
+        if size >= limits['large_throughput_size']:
+            delivered_throughput = limits['large_throughput']
+        else:
+            delivered_throughput = limits['throughput']
+        cost = size * limits['gib_month']
+    elif volume_type in ('st1', 'sc1'):
+        size = max(size, at_least(target_throughput * 1024.0 / limits['throughput_per_tib']))
+        delivered_iops = limits['max_iops']
+        delivered_throughput = min(limits['max_throughput'], size * limits['throughput_per_tib'] / 1024.0)
+        cost = size * limits['gib_month']
+    else:
+        delivered_iops, delivered_throughput = limits['max_iops'], limits['max_throughput']
+        cost = size * limits['gib_month']
+
+    if size > limits['max_size'] or (iops and iops > limits['max_iops']):
+        return None
+    if (throughput and throughput > limits['max_throughput']) or delivered_iops < target_iops or \
+            delivered_throughput < target_throughput:
+        return None
+
+    return dict(volume_type=volume_type, volume_size=size, iops=iops, throughput=throughput,
+                delivered_iops=delivered_iops, delivered_throughput=round(delivered_throughput, 1),
+                monthly_cost=round(cost, 2))
+
+def resolve_performance(performance):
+    """
+    Choose the cheapest volume type, size, IOPS and throughput that meets a performance option.
+
+    Returns:
+        A dict describing the chosen configuration and its headroom over the targets
+    """
+    unknown = set(performance.keys()) - set(['iops', 'throughput', 'min_size', 'types'])
+    if unknown:
+        raise VolumeError("Unsupported keys in performance: %s" % ', '.join(sorted(unknown)))
+
+    try:
+        target_iops = int(performance.get('iops') or 0)
+        target_throughput = float(performance.get('throughput') or 0)
+        min_size = int(performance.get('min_size') or 1)
+    except ValueError:
+        raise VolumeError("performance iops, throughput and min_size must be numbers")
+
+    types = performance.get('types') or PERFORMANCE_VOLUME_TYPES
+    unknown = set(types) - set(VOLUME_TYPES)
+    if unknown:
+        raise VolumeError("Unsupported volume types in performance: %s" % ', '.join(sorted(unknown)))
+
+    candidates = [size_volume_type(volume_type, target_iops, target_throughput, min_size) for volume_type in types]
+    candidates = [candidate for candidate in candidates if candidate is not None]
+    if not candidates:
+        raise VolumeError("None of the volume types %s can provide %d IOPS and %s MB/s"
+                          % (', '.join(types), target_iops, target_throughput))
+
+    sizing = min(candidates, key=lambda candidate: candidate['monthly_cost'])
+    sizing['headroom'] = {
+        'iops': sizing['delivered_iops'] - target_iops,
+        'throughput': round(sizing['delivered_throughput'] - target_throughput, 1),
+        'size': sizing['volume_size'] - min_size
+    }
+    return sizing
+
+def apply_performance(params):
+    """
+    Resolve the performance option of params.
+
+    Returns:
+        A tuple of (params, sizing) where params is a copy of params with volume_type, volume_size, iops and
+        throughput set from the chosen configuration
+    """
+    for key in ('volume_type', 'volume_size', 'iops', 'throughput'):
+        if params.get(key):
+            raise VolumeError("performance cannot be used together with %s" % key)
+
+    sizing = resolve_performance(params['performance'])
+    params = dict(params)
+    for key in ('volume_type', 'volume_size', 'iops', 'throughput'):
+        params[key] = sizing[key]
+    return params, sizing
+
+def get_client_token(params, zone, tags, index=None):
+    """
+    Derive a CreateVolume ClientToken from everything that describes the volume to create, so that
+    retrying the same task returns the volume created by the first attempt instead of a duplicate.
+    """
+    if params.get('client_token'):
+        return params['client_token']
+
+    key = [zone, params.get('instance'), params.get('device_name'), params.get('volume_size'),
+           params.get('volume_type'), params.get('iops'), params.get('throughput'), params.get('snapshot'),
+           bool(params.get('encrypted')), sorted(tags.items()), index]
+    return 'ansible-%s' % hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+def get_item_client_token(client_token, index):
+    """
+    Derive a ClientToken for one of several volumes from the client_token option, so that each volume
+    has its own token rather than all of them sharing one.
+    """
+    return 'ansible-%s' % hashlib.sha1(json.dumps([client_token, index]).encode('utf-8')).hexdigest()
+
+def create_volume(ec2, params, zone, tags, client_token, instance=None):
+    changed = False
+    iops = params.get('iops')
+    encrypted = params.get('encrypted')
+    volume_size = params.get('volume_size')
+    volume_type = params.get('volume_type')
+    throughput = params.get('throughput')
+    snapshot = params.get('snapshot')
+    # If custom iops is defined without a volume_type we use "io1" rather than the default of "standard"
+    if not volume_type:
+        volume_type = 'io1' if iops else 'standard'
+
+    volume = get_volume(ec2, params, instance)
+    if volume is None:
+        # Tagging on create means the volume is never visible without its tags
+        request = {'AvailabilityZone': zone, 'VolumeType': volume_type, 'ClientToken': client_token}
+        if volume_size:
+            request['Size'] = int(volume_size)
+        if snapshot:
+            request['SnapshotId'] = snapshot
+        if iops:
+            request['Iops'] = int(iops)
+        if throughput:
+            request['Throughput'] = int(throughput)
+        if encrypted:
+            request['Encrypted'] = True
+        if tags:
+            request['TagSpecifications'] = [{
+                'ResourceType': 'volume',
+                'Tags': [{'Key': key, 'Value': value} for key, value in sorted(tags.items())]
+            }]
+        response = ec2.create_volume(**request)
+        if response.get('State') == 'creating':
+            volume = Volume(response)
+            volume.tags.update(tags)
+            changed = True
+        elif response.get('State') in ('deleting', 'deleted'):
+            raise VolumeError("Volume %s created by an earlier run with client token %s is %s; set client_token "
+                              "to create a new volume" % (response['VolumeId'], client_token, response['State']))
+        else:
+            # The client token was used by an earlier run, so this is the volume it created, as it is now
+            volume = describe_volumes(ec2, [response['VolumeId']])[0]
+
+    return volume, changed
+
+
+def attach_volume(ec2, params, volume, instance, devices, cache):
+    
+    device_name = params.get('device_name')
+    changed = False
+    
+    if volume.attachment_state() is not None:
+        adata = volume.attach_data
+        if adata.instance_id != instance.id:
+            raise VolumeError("Volume %s is already attached to another instance: %s"
+                              % (volume.id, adata.instance_id))
+    else:
+        # If device_name isn't set, pick the next free name on the instance
+        if device_name is None:
+            device_name = devices.allocate(instance)
+        ec2.attach_volume(VolumeId=volume.id, InstanceId=instance.id, Device=device_name)
+        cache.invalidate(volume.id)
+        changed = True
+
+    return changed
+
+def detach_volume(ec2, volume, cache, force=False):
+    
+    changed = False
+    
+    if volume.attachment_state() is not None:
+        ec2.detach_volume(VolumeId=volume.id, Force=force)
+        cache.invalidate(volume.id)
+        changed = True
+        
+    return changed
+        
+def get_volume_info(volume):
+    
+    volume_info = {}
+    attachment = volume.attach_data
+
+    volume_info = {
+                    'create_time': volume.create_time,
+                    'id': volume.id,
+                    'iops': volume.iops,
+                    'throughput': volume.throughput,
+                    'size': volume.size,
+                    'snapshot_id': volume.snapshot_id,
+                    'status': volume.status,
+                    'type': volume.type,
+                    'zone': volume.zone,
+                    'attachment_set': {
+                        'attach_time': attachment.attach_time,
+                        'device': attachment.device,
+                        'instance_id': attachment.instance_id,
+                        'status': attachment.status
+                    },
+                    'tags': volume.tags
+                }
+    
+    return volume_info
+
+def new_volume_task(params, item=None, index=None):
+    tags = {}
+    if params.get('name'):
+        tags['Name'] = params['name']
+    return dict(item=item, index=index, params=params, tags=tags, changed=False, wait_times={})
+
+def fail_volume_task(task, msg):
+    task['result'] = dict(changed=task['changed'], failed=True, msg=msg)
+
+def prepare_volume(ec2, task, devices, cache, instances):
+    """
+    Validate the parameters of a volume task, find its instance in instances and find or create the volume.
+
+    Newly created volumes are not waited on here; the task's wait_for is set instead so that all
+    volumes can be waited on together.
+    """
+    if task['params'].get('performance'):
+        task['params'], task['sizing'] = apply_performance(task['params'])
+
+    params = task['params']
+    existing = task.get('existing')
+    id = params.get('id')
+    name = params.get('name')
+    instance = params.get('instance')
+    volume_size = params.get('volume_size')
+    device_name = params.get('device_name')
+    zone = params.get('zone')
+    snapshot = params.get('snapshot')
+
+    # Set volume detach flag
+    if instance == 'None' or instance == '':
+        instance = None
+        task['detach'] = True
+    else:
+        task['detach'] = False
+
+    # Here we need to get the zone info for the instance. This covers situation where
+    # instance is specified but zone isn't.
+    # Useful for playbooks chaining instance launch with volume create + attach and where the
+    # zone doesn't matter to the user.
+    task['inst'] = None
+    if instance:
+        inst = task['inst'] = instances.get(instance)
+        zone = inst.placement
+
+        # Check if there is a volume already mounted there.
+        if device_name:
+            mapping = inst.block_device_mapping.get(device_name)
+            if mapping is not None and not (existing and mapping.volume_id == existing.id):
+                if task.get('require_device'):
+                    raise VolumeError("Device %s on instance %s is already used by volume %s"
+                                      % (device_name, instance, mapping.volume_id))
+                task['result'] = dict(msg="Volume mapping for %s already exists on instance %s" % (device_name, instance),
+                                      volume_id=mapping.volume_id,
+                                      device=device_name,
+                                      changed=False)
+                return
+            devices.reserve(inst, device_name)
+
+    # Delaying the checks until after the instance check allows us to get volume ids for existing volumes
+    # without needing to pass an unused volume_size
+    if not volume_size and not (id or name or snapshot):
+        raise VolumeError("You must specify volume_size or identify an existing volume by id, name, or snapshot")
+
+    if volume_size and (snapshot or (id and not params.get('modify'))):
+        raise VolumeError("Cannot specify volume_size together with id or snapshot")
+
+    if existing:
+        volume = existing
+    else:
+        client_token = get_client_token(params, zone, task['tags'], task['index'])
+        # The volumes of instances tasks share a name, so each task only reuses the one attached to its instance
+        scope = task['inst'] if task.get('scope_to_instance') else None
+        volume, task['created'] = create_volume(ec2, params, zone, task['tags'], client_token, scope)
+        task['changed'] = task['created']
+    task['volume_id'] = volume.id
+    cache.store(volume, stale=task['changed'])
+    if task['changed']:
+        task['wait_for'] = 'available'
+    elif params.get('modify'):
+        changes = get_volume_changes(volume, params)
+        if changes:
+            task['modification'] = modify_volume(ec2, volume.id, changes)
+            task['changed'] = True
+            cache.invalidate(volume.id)
+
+def attach_or_detach_volume(ec2, task, devices, cache):
+    volume = cache.get(task['volume_id'])
+    if task['detach']:
+        changed = detach_volume(ec2, volume, cache)
+        condition = 'detached'
+    elif task['inst'] is not None:
+        changed = attach_volume(ec2, task['params'], volume, task['inst'], devices, cache)
+        condition = 'attached'
+    else:
+        return
+
+    if changed:
+        task['changed'] = True
+        task['wait_for'] = condition
+
+def wait_for_volumes(ec2, tasks, cache, wait_timeout):
+    """
+    Wait for the volume of every task with a wait_for condition, sharing a single VolumeWaiter.
+    """
+    waiter = VolumeWaiter(ec2, cache, wait_timeout)
+    waiting = {}
+    for task in tasks:
+        if task.get('wait_for'):
+            waiter.add(task['volume_id'], task['wait_for'])
+            waiting[task['volume_id']] = task
+
+    if not waiting:
+        return
+
+    try:
+        wait_times, failures = waiter.wait()
+    except (BotoCoreError, ClientError) as e:
+        for task in waiting.values():
+            fail_volume_task(task, get_error_message(e))
+        return
+
+    for volume_id, task in waiting.items():
+        if volume_id in failures:
+            fail_volume_task(task, failures[volume_id])
+        else:
+            task['wait_times'][task['wait_for']] = wait_times[volume_id]
+        del task['wait_for']
+
+def wait_for_modifications(ec2, tasks, cache, wait_timeout, condition):
+    """
+    Wait for the modification of every task that modified its volume to reach condition.
+    """
+    waiting = dict((task['volume_id'], task) for task in tasks if task.get('modification'))
+    if not waiting or not condition:
+        return
+
+    waiter = ModificationWaiter(ec2, cache, wait_timeout)
+    for volume_id in waiting:
+        waiter.add(volume_id, condition)
+
+    try:
+        wait_times, failures = waiter.wait()
+    except (BotoCoreError, ClientError) as e:
+        for task in waiting.values():
+            fail_volume_task(task, get_error_message(e))
+        return
+
+    for volume_id, task in waiting.items():
+        task['modification'] = waiter.modifications.get(volume_id, task['modification'])
+        if volume_id in failures:
+            fail_volume_task(task, failures[volume_id])
+        else:
+            task['wait_times'][condition] = wait_times[volume_id]
+
+def run_volume_tasks(ec2, tasks, func, concurrency):
+    """
+    Call func(ec2, task) for every task, recording any failure in the task's result.
+
+    When there is more than one task they are run on a bounded pool of worker threads. boto3
+    clients are thread safe so every worker shares ec2 and its connection pool.
+    """
+
+    def worker(task):
+        try:
+            func(ec2, task)
+        except VolumeError as e:
+            fail_volume_task(task, str(e))
+        except (BotoCoreError, ClientError) as e:
+            fail_volume_task(task, get_error_message(e))
+        except Exception as e:
+            fail_volume_task(task, str(e))
+
+    if len(tasks) <= 1:
+        for task in tasks:
+            worker(task)
+        return
+
+    pool = ThreadPool(max(1, min(concurrency, len(tasks))))
+    try:
+        pool.map(worker, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def provision_volumes(ec2, tasks, concurrency, wait_timeout, modification_wait=None, instances=None):
+    """
+    Create, attach or detach the volume of every task.
+
+    The instances of all tasks are looked up together first, adding to instances if given. Each step
+    is then issued for all tasks before any waiting is done, so volumes are waited on together rather
+    than one after another. Every task has a result once this returns.
+    """
+    devices = DeviceAllocator()
+    cache = VolumeCache()
+    if instances is None:
+        instances = InstanceIndex()
+
+    def active():
+        return [task for task in tasks if 'result' not in task]
+
+    try:
+        instances.load(ec2, [task['params']['instance'] for task in tasks
+                             if task['params'].get('instance') not in (None, '', 'None')])
+    except (BotoCoreError, ClientError) as e:
+        for task in tasks:
+            fail_volume_task(task, get_error_message(e))
+        return
+
+    run_volume_tasks(ec2, active(), lambda conn, task: prepare_volume(conn, task, devices, cache, instances),
+                     concurrency)
+    wait_for_volumes(ec2, active(), cache, wait_timeout)
+    run_volume_tasks(ec2, active(), lambda conn, task: attach_or_detach_volume(conn, task, devices, cache),
+                     concurrency)
+    wait_for_volumes(ec2, active(), cache, wait_timeout)
+    wait_for_modifications(ec2, active(), cache, wait_timeout, modification_wait)
+
+    # Results are built from the cache. Anything still stale is refreshed with one call for all volumes.
+    try:
+        cache.refresh(ec2)
+    except (BotoCoreError, ClientError) as e:
+        for task in active():
+            fail_volume_task(task, get_error_message(e))
+
+    for task in active():
+        task['result'] = dict(changed=task['changed'],
+                              volume=get_volume_info(cache.get(task['volume_id'])),
+                              wait_times=task['wait_times'])
+        if task.get('modification'):
+            task['result']['modification'] = get_modification_info(task['modification'])
+        if task.get('sizing'):
+            task['result']['sizing'] = task['sizing']
+
+def get_volume_performance(volume_type, size, iops, throughput):
+    """
+    Returns:
+        A tuple of the (iops, throughput) a volume delivers according to VOLUME_TYPES. Either may be
+        None if it is not known.
+    """
+    if volume_type not in VOLUME_TYPES or not size:
+        return iops, None
+    limits = VOLUME_TYPES[volume_type]
+    size = int(size)
+
+    if volume_type == 'gp3':
+        delivered_iops = int(iops or limits['baseline_iops'])
+        delivered_throughput = float(throughput or limits['baseline_throughput'])
+    elif volume_type in ('io1', 'io2'):
+        if not iops:
+            return None, None
+        delivered_iops = int(iops)
+        delivered_throughput = min(limits['max_throughput'], delivered_iops * limits['throughput_per_iops'])
+    elif volume_type == 'gp2':
+        delivered_iops = min(limits['max_iops'], max(limits['min_iops'], size * limits['iops_per_gib']))
+        if size >= limits['large_throughput_size']:
+            delivered_throughput = limits['large_throughput']
+        else:
+            delivered_throughput = limits['throughput']
+    elif volume_type in ('st1', 'sc1'):
+        delivered_iops = limits['max_iops']
+        delivered_throughput = min(limits['max_throughput'], size * limits['throughput_per_tib'] / 1024.0)
+    else:
+        delivered_iops, delivered_throughput = limits['max_iops'], limits['max_throughput']
+
+    return delivered_iops, round(delivered_throughput, 1)
+
+def get_stripe_tasks(module, ec2, instances):
+    """
+    Build one volume task per member of the stripe_set option, looking up instance in instances.
+
+    Members are found as a group by their STRIPE_SET_TAG tag with a single DescribeVolumes call, so
+    existing members are reused and only missing ones are created. Members without a device are
+    given one in member order, after any already attached.
+    """
+    stripe = module.params.get('stripe_set')
+    instance = module.params.get('instance')
+
+    unknown = set(stripe.keys()) - set(['name', 'count', 'volume_size', 'volume_type', 'iops', 'throughput',
+                                        'devices'])
+    if unknown:
+        module.fail_json(msg="Unsupported keys in stripe_set: %s" % ', '.join(sorted(unknown)))
+    if not stripe.get('name') or not stripe.get('count'):
+        module.fail_json(msg="stripe_set requires name and count")
+    if not instance:
+        module.fail_json(msg="stripe_set requires instance")
+
+    name = stripe['name']
+    count = int(stripe['count'])
+    devices = stripe.get('devices') or []
+    if devices and len(devices) != count:
+        module.fail_json(msg="stripe_set devices must list one device for each of the %d members" % count)
+
+    try:
+        instances.load(ec2, [instance])
+        members = describe_volumes(ec2, filters={'tag:%s' % STRIPE_SET_TAG: name})
+    except (BotoCoreError, ClientError) as e:
+        module.fail_json(msg=get_error_message(e))
+    try:
+        inst = instances.get(instance)
+    except VolumeError as e:
+        module.fail_json(msg=str(e))
+
+    existing = {}
+    for volume in members:
+        try:
+            existing[int(volume.tags.get(STRIPE_MEMBER_TAG))] = volume
+        except (TypeError, ValueError):
+            module.fail_json(msg="Volume %s in stripe set %s has no valid %s tag" % (volume.id, name, STRIPE_MEMBER_TAG))
+
+    allocator = DeviceAllocator()
+    for index in range(count):
+        volume = existing.get(index)
+        if not devices and volume is not None and volume.attach_data.instance_id == inst.id:
+            allocator.reserve(inst, volume.attach_data.device)
+
+    tasks = []
+    for index in range(count):
+        params = dict((k, module.params.get(k)) for k in VOLUME_SPEC_KEYS)
+        params.update(id=None, name=None, snapshot=None, performance=None,
+                      volume_size=stripe.get('volume_size'), volume_type=stripe.get('volume_type'),
+                      iops=stripe.get('iops'), throughput=stripe.get('throughput'))
+        if params.get('client_token'):
+            params['client_token'] = get_item_client_token(params['client_token'], index)
+
+        volume = existing.get(index)
+        if devices:
+            params['device_name'] = devices[index]
+        elif volume is not None and volume.attach_data.instance_id == inst.id:
+            params['device_name'] = volume.attach_data.device
+        else:
+            params['device_name'] = allocator.allocate(inst)
+
+        task = new_volume_task(params, dict(stripe_set=name, member=index))
+        task['tags'] = {'Name': '%s-%d' % (name, index), STRIPE_SET_TAG: name, STRIPE_MEMBER_TAG: str(index)}
+        task['require_device'] = True
+        if volume is not None:
+            task['existing'] = volume
+        tasks.append(task)
+
+    extra = sorted(volume.id for index, volume in existing.items() if index >= count)
+    return tasks, extra
+
+def get_stripe_set_info(name, tasks, extra):
+    """
+    Summarise the members of a stripe set in member order, with the aggregate size, IOPS and throughput.
+    """
+    volume_ids = []
+    devices = []
+    size = iops = throughput = 0
+    for task in tasks:
+        volume = task['result']['volume']
+        volume_ids.append(volume['id'])
+        devices.append(volume['attachment_set']['device'])
+        member_iops, member_throughput = get_volume_performance(volume['type'], volume['size'], volume['iops'],
+                                                                volume['throughput'])
+        size += int(volume['size'])
+        iops = None if iops is None or member_iops is None else iops + int(member_iops)
+        throughput = None if throughput is None or member_throughput is None else throughput + member_throughput
+
+    return dict(name=name, volume_ids=volume_ids, devices=devices, size=size, iops=iops, throughput=throughput,
+                extra_volume_ids=extra)
+
+def get_volume_tasks(module):
+    """
+    Merge each item of the volumes option with the module level options.
+
+    Returns:
+        A list of volume tasks
+    """
+    tasks = []
+    for index, item in enumerate(module.params.get('volumes')):
+        if not isinstance(item, dict):
+            module.fail_json(msg="Each item in volumes must be a dict, item %d is not" % index)
+        unknown = set(item.keys()) - set(VOLUME_SPEC_KEYS)
+        if unknown:
+            module.fail_json(msg="Unsupported keys in volumes item %d: %s" % (index, ', '.join(sorted(unknown))))
+
+        params = dict((k, module.params.get(k)) for k in VOLUME_SPEC_KEYS)
+        if params.get('client_token'):
+            params['client_token'] = get_item_client_token(params['client_token'], index)
+        params.update(item)
+        if not (params.get('instance') or params.get('zone') or params.get('id')):
+            module.fail_json(msg="You must specify either instance or zone for volumes item %d" % index)
+        tasks.append(new_volume_task(params, item, index))
+
+    return tasks
+
+def get_instance_tasks(module):
+    """
+    Build one volume task from the module options for each instance in the instances option.
+    """
+    tasks = []
+    for index, instance in enumerate(module.params.get('instances')):
+        params = dict((k, module.params.get(k)) for k in VOLUME_SPEC_KEYS)
+        params['instance'] = instance
+        task = new_volume_task(params, dict(instance=instance), index)
+        task['scope_to_instance'] = True
+        tasks.append(task)
+
+    return tasks
+
+def main():
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(dict(
+            instance = dict(),
+            id = dict(),
+            name = dict(),
+            volume_size = dict(),
+            volume_type = dict(choices=['standard', 'gp2', 'gp3', 'io1', 'io2', 'st1', 'sc1']),
+            iops = dict(),
+            encrypted = dict(),
+            device_name = dict(),
+            zone = dict(aliases=['availability_zone', 'aws_zone', 'ec2_zone']),
+            snapshot = dict(),
+            state = dict(choices=['absent', 'present', 'list', 'report'], default='present'),
+            volumes = dict(type='list'),
+            instances = dict(type='list'),
+            concurrency = dict(type='int', default=10),
+            wait_timeout = dict(type='int', default=300),
+            filters = dict(type='dict'),
+            page_size = dict(type='int', default=500),
+            limit = dict(type='int'),
+            fields = dict(type='list'),
+            modify = dict(type='bool', default=False),
+            modification_wait = dict(choices=['none', 'optimizing', 'completed'], default='optimizing'),
+            throughput = dict(type='int'),
+            performance = dict(type='dict'),
+            stripe_set = dict(type='dict'),
+            client_token = dict(),
+            instrumentation = dict(type='bool', default=False),
+            volume_ids = dict(type='list'),
+            force_detach = dict(type='bool', default=False),
+            delete_rate = dict(type='float', default=10),
+            owner_tag = dict(default='Owner'),
+            max_attempts = dict(type='int', default=10),
+            prices = dict(type='dict')
+        )
+    )
+    module = AnsibleModule(argument_spec=argument_spec)
+
+    if not HAS_BOTO3:
+        module.fail_json(msg='boto3 required for this module')
+
+    id = module.params.get('id')
+    zone = module.params.get('zone')
+    state = module.params.get('state')
+    volumes = module.params.get('volumes')
+    instances = module.params.get('instances')
+    stripe_set = module.params.get('stripe_set')
+
+    if volumes is not None and state != 'present':
+        module.fail_json(msg="volumes is only supported with state=present")
+
+    if stripe_set is not None and (state != 'present' or volumes is not None):
+        module.fail_json(msg="stripe_set is only supported with state=present and cannot be used with volumes")
+
+    if instances is not None:
+        if state != 'present' or volumes is not None or stripe_set is not None:
+            module.fail_json(msg="instances is only supported with state=present and cannot be used with volumes "
+                                 "or stripe_set")
+        if module.params.get('instance') or id or module.params.get('client_token'):
+            module.fail_json(msg="instances cannot be used together with instance, id or client_token")
+
+    volume_ids = module.params.get('volume_ids')
+    filters = module.params.get('filters')
+    if volume_ids is not None and state != 'absent':
+        module.fail_json(msg="volume_ids is only supported with state=absent")
+    if state == 'absent':
+        if id:
+            volume_ids = [id] + (volume_ids or [])
+        if not volume_ids and not filters:
+            module.fail_json(msg="state=absent requires id, volume_ids or filters")
+        if volume_ids and filters:
+            module.fail_json(msg="filters cannot be used together with id or volume_ids")
+
+    # Ensure we have the zone or can get the zone
+    if volumes is None and instances is None and stripe_set is None and id is None and zone is None \
+            and state == 'present':
+        module.fail_json(msg="You must specify either instance or zone")
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module, boto3=True)
+
+    metrics = None
+    if module.params.get('instrumentation'):
+        metrics = ApiMetrics()
+
+    def exit_json(**result):
+        if metrics is not None:
+            result['metrics'] = metrics.summary()
+        module.exit_json(**result)
+
+    def fail_json(**result):
+        if metrics is not None:
+            result['metrics'] = metrics.summary()
+        module.fail_json(**result)
+    
+    if not region:
+        module.fail_json(msg="region must be specified")
+
+    # One client, and so one connection pool, is shared by all worker threads
+    config = Config(retries={'mode': 'adaptive', 'max_attempts': module.params.get('max_attempts')},
+                    max_pool_connections=max(10, module.params.get('concurrency')))
+    try:
+        ec2 = boto3_conn(module, conn_type='client', resource='ec2', region=region, endpoint=ec2_url,
+                         config=config, **aws_connect_params)
+    except (BotoCoreError, ClientError) as e:
+        module.fail_json(msg=get_error_message(e))
+    if metrics is not None:
+        ec2 = InstrumentedConnection(ec2, metrics)
+
+    if state == 'list':
+        returned_volumes, truncated = list_volumes(module, ec2)
+        exit_json(changed=False, volumes=returned_volumes, truncated=truncated)
+
+    if state == 'report':
+        exit_json(changed=False, report=report_volumes(module, ec2))
+
+    if state == 'present':
+        instance_index = InstanceIndex()
+        if volumes is not None:
+            tasks = get_volume_tasks(module)
+        elif instances is not None:
+            tasks = get_instance_tasks(module)
+        elif stripe_set is not None:
+            tasks, extra = get_stripe_tasks(module, ec2, instance_index)
+        else:
+            tasks = [new_volume_task(module.params)]
+
+        modification_wait = module.params.get('modification_wait')
+        if modification_wait == 'none':
+            modification_wait = None
+        provision_volumes(ec2, tasks, module.params.get('concurrency'), module.params.get('wait_timeout'),
+                          modification_wait, instance_index)
+
+        if volumes is None and instances is None and stripe_set is None:
+            result = tasks[0]['result']
+            if result.get('failed'):
+                fail_json(msg=result['msg'])
+            exit_json(**result)
+
+        results = []
+        for task in tasks:
+            task['result']['item'] = task['item']
+            results.append(task['result'])
+        changed = any(r['changed'] for r in results)
+        failed = [r for r in results if r.get('failed')]
+        if failed:
+            fail_json(msg="%d of %d volumes failed" % (len(failed), len(results)),
+                      changed=changed, results=results)
+        if stripe_set is not None:
+            exit_json(changed=changed, results=results,
+                      stripe_set=get_stripe_set_info(stripe_set['name'], tasks, extra))
+        exit_json(changed=changed, results=results)
+    elif state == 'absent':
+        try:
+            volumes, missing = find_volumes(ec2, volume_ids, filters, module.params.get('page_size'))
+        except (BotoCoreError, ClientError) as e:
+            fail_json(msg=get_error_message(e))
+
+        result = delete_volumes(ec2, volumes, module.params.get('force_detach'),
+                                module.params.get('concurrency'), module.params.get('delete_rate'),
+                                module.params.get('wait_timeout'))
+        result['absent'] = sorted(result['absent'] + missing)
+        if result['failures']:
+            fail_json(msg="%d of %d volumes could not be deleted" % (len(result['failures']), len(volumes)), **result)
+        exit_json(**result)
+
+# import module snippets
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+
+main()
@@ -27,6 +27,24 @@ options:
       - A dict of filters to apply. Each dict item consists of a filter key and a filter value. See U(http://docs.aws.amazon.com/AWSEC2/latest/APIReference/API_DescribeSubnets.html) for possible filters.
     required: false
     default: null
+  lookup_addresses:
+    description:
+      - A list of IPv4 addresses or CIDR blocks to find the subnets, and the VPCs of the subnets gathered, that
+        contain them. Returns C(address_lookups), a dict keyed by address of the matching C(subnets), with their
+        total, usable, available and used address counts, and C(vpcs), innermost first.
+    required: false
+    default: null
+    version_added: "2.1"
+  report_address_space:
+    description:
+      - Whether to return C(address_space), with the C(vpcs) of the subnets gathered, keyed by VPC id, with how
+        many of their addresses are in subnets and the C(unused_blocks) that are not, and the
+        C(overlapping_vpcs) and C(overlapping_subnets), as pairs of ids, whose CIDR blocks overlap.
+      - Only the subnets gathered count as used, so with C(filters) the space of other subnets is unused.
+    required: false
+    default: no
+    choices: ['yes', 'no']
+    version_added: "2.1"
   region:
     description:
       - The AWS region to use. If not specified then the value of the EC2_REGION environment variable, if any, is used. See U(http://docs.aws.amazon.com/general/latest/gr/rande.html#ec2_region)
@@ -58,8 +76,28 @@ EXAMPLES = '''
     filters:
       - vpc-id: vpc-abcdef00
 
+# Find the subnets that hold a couple of addresses and a CIDR block
+- ec2_vpc_subnet_facts:
+    lookup_addresses:
+      - 10.0.1.25
+      - 10.0.2.200
+      - 10.0.3.0/28
+  register: subnet_facts
+
+- debug:
+    msg: "10.0.1.25 is in {{ subnet_facts.address_lookups['10.0.1.25'].subnets[0].id }}"
+
+# Report the unused and overlapping address space of all VPCs with subnets
+- ec2_vpc_subnet_facts:
+    report_address_space: yes
+
 '''
 
+import bisect
+import heapq
+import socket
+import struct
+
 try:
     import boto.vpc
     from boto.exception import BotoServerError
@@ -82,27 +120,236 @@ def get_subnet_info(subnet):
 
     return subnet_info
 
+def cidr_range(cidr):
+    """
+    Turn an IPv4 address or CIDR block into the first and last addresses it covers, as integers.
+
+    Raises:
+        ValueError if cidr is not an IPv4 address or CIDR block
+    """
+
+    address, _, prefix = cidr.partition('/')
+    try:
+        if len(address.split('.')) != 4:
+            raise socket.error()
+        value = struct.unpack('!I', socket.inet_aton(address))[0]
+        prefix = int(prefix) if prefix else 32
+    except (socket.error, ValueError):
+        raise ValueError("%s is not an IPv4 address or CIDR block" % cidr)
+    if not 0 <= prefix <= 32:
+        raise ValueError("%s is not an IPv4 address or CIDR block" % cidr)
+
+    size = 1 << (32 - prefix)
+    start = value & ~(size - 1) & 0xffffffff
+    return start, start + size - 1
+
+def range_to_cidrs(start, end):
+    """
+    Turn a range of addresses, as integers, into the fewest CIDR blocks that cover it exactly.
+    """
+
+    cidrs = []
+    while start <= end:
+        # The largest block aligned at start that does not go past end
+        size = start & -start or 1 << 32
+        while size > end - start + 1:
+            size >>= 1
+        prefix = 32 - size.bit_length() + 1
+        cidrs.append("%s/%d" % (socket.inet_ntoa(struct.pack('!I', start)), prefix))
+        start += size
+
+    return cidrs
+
+class CidrIndex(object):
+    """
+    An index of CIDR blocks for finding the blocks that contain an address or CIDR block.
+
+    Any two CIDR blocks are either disjoint or one contains the other, so sorted by first address, and
+    largest first, each block's enclosing blocks all come before it. Each block keeps a link to the
+    nearest of them, and a lookup is a binary search for the last block starting at or before the address
+    followed by a walk up those links.
+    """
+
+    def __init__(self, blocks):
+        """
+        blocks is an iterable of (cidr_block, item) tuples.
+        """
+        self.starts = []
+        self.ends = []
+        self.items = []
+        self.parents = []
+
+        entries = sorted((cidr_range(cidr) + (item,) for cidr, item in blocks), key=lambda e: (e[0], -e[1]))
+        stack = []
+        for start, end, item in entries:
+            while stack and self.ends[stack[-1]] < start:
+                stack.pop()
+            self.parents.append(stack[-1] if stack else None)
+            stack.append(len(self.starts))
+            self.starts.append(start)
+            self.ends.append(end)
+            self.items.append(item)
+
+    def lookup(self, cidr):
+        """
+        Find the items of the blocks that contain cidr, innermost first.
+        """
+        start, end = cidr_range(cidr)
+
+        i = bisect.bisect_right(self.starts, start) - 1
+        if i < 0:
+            return []
+        while i is not None and self.ends[i] < end:
+            i = self.parents[i]
+
+        items = []
+        while i is not None:
+            items.append(self.items[i])
+            i = self.parents[i]
+        return items
+
+def find_overlaps(blocks):
+    """
+    Find the pairs of blocks whose CIDR blocks overlap, sweeping them in order of first address with a
+    heap of the blocks still open.
+
+    blocks is an iterable of (cidr_block, id) tuples.
+    """
+
+    overlaps = []
+    open_blocks = []
+    for start, end, block_id in sorted(cidr_range(cidr) + (block_id,) for cidr, block_id in blocks):
+        while open_blocks and open_blocks[0][0] < start:
+            heapq.heappop(open_blocks)
+        for open_end, open_id in open_blocks:
+            overlaps.append([open_id, block_id])
+        heapq.heappush(open_blocks, (end, block_id))
+
+    return overlaps
+
+def get_address_stats(subnet_info):
+
+    start, end = cidr_range(subnet_info['cidr_block'])
+    total = end - start + 1
+    # AWS reserves the first four and the last address of every subnet
+    usable = max(total - 5, 0)
+    available = subnet_info['available_ip_address_count']
+
+    return { 'total_addresses': total,
+             'usable_addresses': usable,
+             'available_addresses': available,
+             'used_addresses': usable - available
+           }
+
+def get_address_lookups(subnet_dict_array, vpcs, addresses):
+    """
+    Find the subnets and VPCs that contain each of addresses.
+
+    Raises:
+        ValueError if an address is not an IPv4 address or CIDR block
+    """
+
+    subnet_index = CidrIndex((subnet_info['cidr_block'], subnet_info) for subnet_info in subnet_dict_array)
+    vpc_index = CidrIndex((vpc.cidr_block, vpc) for vpc in vpcs)
+
+    lookups = {}
+    for address in addresses:
+        subnets = []
+        for subnet_info in subnet_index.lookup(address):
+            subnet = { 'id': subnet_info['id'],
+                       'vpc_id': subnet_info['vpc_id'],
+                       'cidr_block': subnet_info['cidr_block'],
+                       'availability_zone': subnet_info['availability_zone']
+                     }
+            subnet.update(get_address_stats(subnet_info))
+            subnets.append(subnet)
+        lookups[address] = { 'subnets': subnets,
+                             'vpcs': [{ 'id': vpc.id, 'cidr_block': vpc.cidr_block } for vpc in vpc_index.lookup(address)]
+                           }
+
+    return lookups
+
+def get_address_space(subnet_dict_array, vpcs):
+    """
+    Report how much of the address space of each VPC is in subnets, the blocks that are not, and the VPCs
+    and subnets whose CIDR blocks overlap.
+    """
+
+    vpc_subnets = {}
+    for subnet_info in subnet_dict_array:
+        vpc_subnets.setdefault(subnet_info['vpc_id'], []).append(cidr_range(subnet_info['cidr_block']))
+
+    vpc_space = {}
+    for vpc in vpcs:
+        vpc_start, vpc_end = cidr_range(vpc.cidr_block)
+        unused_blocks = []
+        subnet_addresses = 0
+        # Walk the subnets in order, collecting the gaps between them
+        next_start = vpc_start
+        for start, end in sorted(vpc_subnets.get(vpc.id, [])):
+            start, end = max(start, vpc_start), min(end, vpc_end)
+            if end < next_start:
+                continue
+            if start > next_start:
+                unused_blocks.extend(range_to_cidrs(next_start, start - 1))
+            subnet_addresses += end - max(start, next_start) + 1
+            next_start = end + 1
+        if next_start <= vpc_end:
+            unused_blocks.extend(range_to_cidrs(next_start, vpc_end))
+
+        total = vpc_end - vpc_start + 1
+        vpc_space[vpc.id] = { 'cidr_block': vpc.cidr_block,
+                              'total_addresses': total,
+                              'subnet_addresses': subnet_addresses,
+                              'unused_addresses': total - subnet_addresses,
+                              'unused_blocks': unused_blocks
+                            }
+
+    return { 'vpcs': vpc_space,
+             'overlapping_vpcs': find_overlaps((vpc.cidr_block, vpc.id) for vpc in vpcs),
+             'overlapping_subnets': find_overlaps((subnet_info['cidr_block'], subnet_info['id'])
+                                                  for subnet_info in subnet_dict_array)
+           }
+
 def list_ec2_vpc_subnets(connection, module):
 
     filters = module.params.get("filters")
+    lookup_addresses = module.params.get("lookup_addresses")
+    report_address_space = module.params.get("report_address_space")
     subnet_dict_array = []
 
     try:
         all_subnets = connection.get_all_subnets(filters=filters)
+        # The VPCs of the subnets are only needed for their CIDR blocks
+        vpcs = []
+        vpc_ids = sorted(set(subnet.vpc_id for subnet in all_subnets))
+        if (lookup_addresses or report_address_space) and vpc_ids:
+            vpcs = connection.get_all_vpcs(vpc_ids=vpc_ids)
     except BotoServerError as e:
         module.fail_json(msg=e.message)
 
     for subnet in all_subnets:
         subnet_dict_array.append(get_subnet_info(subnet))
 
-    module.exit_json(subnets=subnet_dict_array)
+    result = dict(subnets=subnet_dict_array)
+    if lookup_addresses:
+        try:
+            result['address_lookups'] = get_address_lookups(subnet_dict_array, vpcs, lookup_addresses)
+        except ValueError as e:
+            module.fail_json(msg=str(e))
+    if report_address_space:
+        result['address_space'] = get_address_space(subnet_dict_array, vpcs)
+
+    module.exit_json(**result)
 
 
 def main():
     argument_spec = ec2_argument_spec()
     argument_spec.update(
         dict(
-            filters = dict(default=None, type='dict')
+            filters = dict(default=None, type='dict'),
+            lookup_addresses = dict(default=None, type='list'),
+            report_address_space = dict(default=False, type='bool')
         )
     )
 
@@ -0,0 +1,351 @@
+#!/usr/bin/python
+#
+# This is a free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This Ansible library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+DOCUMENTATION = '''
+---
+module: ec2_vpc_topology_facts
+short_description: Gather facts about the topology of ec2 VPCs in AWS
+description:
+    - Gather facts about ec2 VPCs in AWS along with their subnets, route tables, internet gateways, DHCP option sets
+      and network ACLs, returned as a cross-linked index keyed by id.
+    - The six kinds of resource are described concurrently, each with its own connection.
+version_added: "2.1"
+author: "Rob White (@wimnat)"
+options:
+  vpc_ids:
+    description:
+      - A list of the IDs of the VPCs to gather facts about. Only the resources of these VPCs, and the DHCP option
+        sets they use, are returned. Otherwise, all VPCs are returned.
+    required: false
+    default: null
+  region:
+    description:
+      - The AWS region to use. If not specified then the value of the EC2_REGION environment variable, if any, is used. See U(http://docs.aws.amazon.com/general/latest/gr/rande.html#ec2_region)
+    required: false
+    default: null
+    aliases: [ 'aws_region', 'ec2_region' ]
+
+extends_documentation_fragment: aws
+'''
+
+EXAMPLES = '''
+# Note: These examples do not set authentication details, see the AWS Guide for details.
+
+# Gather facts about the topology of all VPCs
+- ec2_vpc_topology_facts:
+  register: topology
+
+# List the route table and internet gateways of each subnet of a VPC
+- debug:
+    msg: "{{ item }}: {{ topology.route_tables[topology.subnets[item].route_table_id].gateway_ids }}"
+  with_items: "{{ topology.vpcs['vpc-00112233'].subnet_ids }}"
+
+# Gather facts about the topology of two particular VPCs
+- ec2_vpc_topology_facts:
+    vpc_ids:
+      - vpc-00112233
+      - vpc-44556677
+
+'''
+
+RETURN = '''
+vpcs:
+    description: The VPCs keyed by id, each with the ids of its C(subnet_ids), C(route_table_ids),
+                 C(main_route_table_id), C(internet_gateway_ids) and C(network_acl_ids).
+    type: dict
+subnets:
+    description: The subnets keyed by id, each with the C(route_table_id) and C(network_acl_id) that apply to it.
+    type: dict
+route_tables:
+    description: The route tables keyed by id, each with the C(subnet_ids) explicitly associated with it and the
+                 C(gateway_ids) its routes use.
+    type: dict
+internet_gateways:
+    description: The internet gateways keyed by id, each with the C(vpc_ids) it is attached to.
+    type: dict
+dhcp_options:
+    description: The DHCP option sets keyed by id, each with the C(vpc_ids) that use it.
+    type: dict
+network_acls:
+    description: The network ACLs keyed by id, each with the C(subnet_ids) associated with it.
+    type: dict
+'''
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import boto.vpc
+    from boto.exception import BotoServerError
+    HAS_BOTO = True
+except ImportError:
+    HAS_BOTO = False
+
+def get_vpc_info(vpc):
+
+    vpc_info = { 'id': vpc.id,
+                 'instance_tenancy': vpc.instance_tenancy,
+                 'classic_link_enabled': vpc.classic_link_enabled,
+                 'dhcp_options_id': vpc.dhcp_options_id,
+                 'state': vpc.state,
+                 'is_default': vpc.is_default,
+                 'cidr_block': vpc.cidr_block,
+                 'tags': vpc.tags
+               }
+
+    return vpc_info
+
+def get_subnet_info(subnet):
+
+    subnet_info = { 'id': subnet.id,
+                    'availability_zone': subnet.availability_zone,
+                    'available_ip_address_count': subnet.available_ip_address_count,
+                    'cidr_block': subnet.cidr_block,
+                    'default_for_az': subnet.defaultForAz,
+                    'map_public_ip_on_launch': subnet.mapPublicIpOnLaunch,
+                    'state': subnet.state,
+                    'tags': subnet.tags,
+                    'vpc_id': subnet.vpc_id
+                  }
+
+    return subnet_info
+
+def get_route_table_info(route_table):
+
+    # Add any routes to array
+    routes = []
+    for route in route_table.routes:
+        routes.append(route.__dict__)
+
+    route_table_info = { 'id': route_table.id,
+                         'routes': routes,
+                         'tags': route_table.tags,
+                         'vpc_id': route_table.vpc_id
+                       }
+
+    return route_table_info
+
+def get_dhcp_opt_set_info(dhcp_opt_set):
+
+    dhcp_opt_set_info = { 'id': dhcp_opt_set.id,
+                          'options': dhcp_opt_set.options,
+                          'tags': dhcp_opt_set.tags
+                        }
+
+    return dhcp_opt_set_info
+
+def get_internet_gateway_info(internet_gateway):
+
+    # Add any attachments to array
+    attachments = []
+    for attachment in internet_gateway.attachments:
+        attachments.append({ 'vpc_id': attachment.vpc_id, 'state': attachment.state })
+
+    internet_gateway_info = { 'id': internet_gateway.id,
+                              'attachments': attachments,
+                              'tags': internet_gateway.tags
+                            }
+
+    return internet_gateway_info
+
+def get_network_acl_info(network_acl):
+
+    # Add any entries to array
+    entries = []
+    for entry in network_acl.network_acl_entries:
+        entries.append({ 'rule_number': int(entry.rule_number),
+                         'protocol': entry.protocol,
+                         'rule_action': entry.rule_action,
+                         'egress': entry.egress == 'true',
+                         'cidr_block': entry.cidr_block,
+                         'from_port': entry.port_range.from_port,
+                         'to_port': entry.port_range.to_port
+                       })
+
+    network_acl_info = { 'id': network_acl.id,
+                         'default': getattr(network_acl, 'default', None) == 'true',
+                         'entries': entries,
+                         'tags': network_acl.tags,
+                         'vpc_id': network_acl.vpc_id
+                       }
+
+    return network_acl_info
+
+def describe_resources(region, aws_connect_params, vpc_ids):
+    """
+    Describe the VPCs, subnets, route tables, internet gateways, DHCP option sets and network ACLs at the
+    same time, one worker thread each.
+
+    boto connections are not thread safe so each worker opens its own connection to the VPC API.
+
+    Returns:
+        A dict keyed by kind of resource of the boto objects described
+    """
+
+    vpc_filters = None
+    if vpc_ids:
+        vpc_filters = { 'vpc-id': vpc_ids }
+
+    requests = [
+        ('vpcs', lambda connection: connection.get_all_vpcs(vpc_ids=vpc_ids or None)),
+        ('subnets', lambda connection: connection.get_all_subnets(filters=vpc_filters)),
+        ('route_tables', lambda connection: connection.get_all_route_tables(filters=vpc_filters)),
+        ('internet_gateways', lambda connection: connection.get_all_internet_gateways(
+            filters={ 'attachment.vpc-id': vpc_ids } if vpc_ids else None)),
+        ('dhcp_options', lambda connection: connection.get_all_dhcp_options()),
+        ('network_acls', lambda connection: connection.get_all_network_acls(filters=vpc_filters))
+    ]
+
+    def worker(request):
+        kind, describe = request
+        connection = connect_to_aws(boto.vpc, region, **aws_connect_params)
+        return kind, describe(connection)
+
+    pool = ThreadPool(len(requests))
+    try:
+        return dict(pool.map(worker, requests))
+    finally:
+        pool.close()
+        pool.join()
+
+def build_topology(resources):
+    """
+    Index the described resources by id and link each to the others: VPCs to their subnets, route tables,
+    internet gateways and network ACLs, subnets to the route table and network ACL that apply to them,
+    route tables to their subnets and the gateways their routes use, internet gateways and DHCP option sets
+    to their VPCs and network ACLs to their subnets.
+    """
+
+    vpcs = {}
+    for vpc in resources['vpcs']:
+        vpc_info = get_vpc_info(vpc)
+        vpc_info.update({ 'subnet_ids': [],
+                          'route_table_ids': [],
+                          'main_route_table_id': None,
+                          'internet_gateway_ids': [],
+                          'network_acl_ids': []
+                        })
+        vpcs[vpc.id] = vpc_info
+
+    subnets = {}
+    for subnet in resources['subnets']:
+        subnet_info = get_subnet_info(subnet)
+        subnet_info.update({ 'route_table_id': None, 'network_acl_id': None })
+        subnets[subnet.id] = subnet_info
+        if subnet.vpc_id in vpcs:
+            vpcs[subnet.vpc_id]['subnet_ids'].append(subnet.id)
+
+    route_tables = {}
+    for route_table in resources['route_tables']:
+        route_table_info = get_route_table_info(route_table)
+        route_table_info['subnet_ids'] = []
+        route_table_info['gateway_ids'] = sorted(set(route.gateway_id for route in route_table.routes
+                                                     if route.gateway_id and route.gateway_id != 'local'))
+        route_tables[route_table.id] = route_table_info
+        vpc_info = vpcs.get(route_table.vpc_id)
+        if vpc_info:
+            vpc_info['route_table_ids'].append(route_table.id)
+        for association in route_table.associations:
+            if association.main and vpc_info:
+                vpc_info['main_route_table_id'] = route_table.id
+            elif association.subnet_id in subnets:
+                route_table_info['subnet_ids'].append(association.subnet_id)
+                subnets[association.subnet_id]['route_table_id'] = route_table.id
+
+    # Subnets without a route table of their own use the main route table of their VPC
+    for subnet_info in subnets.values():
+        if subnet_info['route_table_id'] is None and subnet_info['vpc_id'] in vpcs:
+            subnet_info['route_table_id'] = vpcs[subnet_info['vpc_id']]['main_route_table_id']
+
+    internet_gateways = {}
+    for internet_gateway in resources['internet_gateways']:
+        internet_gateway_info = get_internet_gateway_info(internet_gateway)
+        internet_gateway_info['vpc_ids'] = [attachment['vpc_id'] for attachment in internet_gateway_info['attachments']]
+        internet_gateways[internet_gateway.id] = internet_gateway_info
+        for vpc_id in internet_gateway_info['vpc_ids']:
+            if vpc_id in vpcs:
+                vpcs[vpc_id]['internet_gateway_ids'].append(internet_gateway.id)
+
+    dhcp_options = {}
+    for dhcp_opt_set in resources['dhcp_options']:
+        vpc_ids = [vpc_id for vpc_id, vpc_info in vpcs.items() if vpc_info['dhcp_options_id'] == dhcp_opt_set.id]
+        dhcp_opt_set_info = get_dhcp_opt_set_info(dhcp_opt_set)
+        dhcp_opt_set_info['vpc_ids'] = sorted(vpc_ids)
+        dhcp_options[dhcp_opt_set.id] = dhcp_opt_set_info
+
+    network_acls = {}
+    for network_acl in resources['network_acls']:
+        network_acl_info = get_network_acl_info(network_acl)
+        network_acl_info['subnet_ids'] = []
+        network_acls[network_acl.id] = network_acl_info
+        if network_acl.vpc_id in vpcs:
+            vpcs[network_acl.vpc_id]['network_acl_ids'].append(network_acl.id)
+        for association in network_acl.associations:
+            if association.subnet_id in subnets:
+                network_acl_info['subnet_ids'].append(association.subnet_id)
+                subnets[association.subnet_id]['network_acl_id'] = network_acl.id
+
+    return { 'vpcs': vpcs,
+             'subnets': subnets,
+             'route_tables': route_tables,
+             'internet_gateways': internet_gateways,
+             'dhcp_options': dhcp_options,
+             'network_acls': network_acls
+           }
+
+def list_ec2_vpc_topology(module, region, aws_connect_params):
+
+    vpc_ids = module.params.get("vpc_ids")
+
+    try:
+        resources = describe_resources(region, aws_connect_params, vpc_ids)
+    except BotoServerError as e:
+        module.fail_json(msg=e.message)
+    except (boto.exception.NoAuthHandlerFound, StandardError), e:
+        module.fail_json(msg=str(e))
+
+    topology = build_topology(resources)
+    if vpc_ids:
+        # DHCP option sets cannot be filtered by VPC, so only those the VPCs use are kept
+        topology['dhcp_options'] = dict((dhcp_options_id, dhcp_opt_set_info) for dhcp_options_id, dhcp_opt_set_info
+                                        in topology['dhcp_options'].items() if dhcp_opt_set_info['vpc_ids'])
+
+    module.exit_json(**topology)
+
+
+def main():
+    argument_spec = ec2_argument_spec()
+    argument_spec.update(
+        dict(
+            vpc_ids = dict(default=None, type='list')
+        )
+    )
+
+    module = AnsibleModule(argument_spec=argument_spec)
+
+    if not HAS_BOTO:
+        module.fail_json(msg='boto required for this module')
+
+    region, ec2_url, aws_connect_params = get_aws_connection_info(module)
+
+    if not region:
+        module.fail_json(msg="region must be specified")
+
+    list_ec2_vpc_topology(module, region, aws_connect_params)
+
+from ansible.module_utils.basic import *
+from ansible.module_utils.ec2 import *
+
+if __name__ == '__main__':
+    main()